@@ -0,0 +1,95 @@
+import asyncio
+import os
+import re
+import shutil
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from models import DownloadProgress
+from settings import (DOWNLOAD_DIR, DOWNLOAD_BANDWIDTH, DOWNLOAD_BANDWIDTH_SCHEDULE, DOWNLOAD_DISK_RESERVE,
+                      DOWNLOAD_SIZE_ESTIMATE, DOWNLOAD_DISK_CHECK_INTERVAL, DOWNLOAD_MIN_SPEED, WORKER_PROCESSES)
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value: str) -> int:
+    # Same notation as yt-dlp's --limit-rate: 500K, 4.2M, 1G.
+    match = re.fullmatch(r"([\d.]+)\s*([KMGT]?)I?B?", value.strip().upper())
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_minutes(value: str) -> int:
+    hours, minutes = value.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_schedule(value: str) -> List[Tuple[int, int, int]]:
+    """
+    "01:00-07:00=0,18:00-23:00=2M" -> [(start minute, end minute, bytes per second)]; 0 means unlimited.
+    """
+    windows = []
+    for part in filter(None, (part.strip() for part in value.split(","))):
+        span, rate = part.split("=")
+        start, end = span.split("-")
+        windows.append((parse_minutes(start), parse_minutes(end), parse_size(rate)))
+    return windows
+
+
+bandwidth = parse_size(DOWNLOAD_BANDWIDTH)
+schedule = parse_schedule(DOWNLOAD_BANDWIDTH_SCHEDULE)
+disk_reserve = parse_size(DOWNLOAD_DISK_RESERVE)
+size_estimate = parse_size(DOWNLOAD_SIZE_ESTIMATE)
+min_speed = parse_size(DOWNLOAD_MIN_SPEED)
+
+
+def share(rate: int) -> int:
+    # Every worker process paces its own jobs, so each keeps to its part of the budget; 0 stays unlimited.
+    return max(rate // WORKER_PROCESSES, 1) if rate else 0
+
+
+def current_budget(now: Optional[datetime] = None) -> int:
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for start, end, rate in schedule:
+        # A window may wrap around midnight, e.g. 23:00-06:00.
+        inside = start <= minute < end if start <= end else minute >= start or minute < end
+        if inside:
+            return share(rate)
+    return share(bandwidth)
+
+
+def remaining_bytes(progress: DownloadProgress) -> int:
+    total = progress.total_bytes or size_estimate
+    return max(total - progress.downloaded_bytes, 0)
+
+
+def get_disk_status(running: List[DownloadProgress]) -> dict:
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    return {
+        "free": shutil.disk_usage(DOWNLOAD_DIR).free,
+        # Bytes the running downloads are still expected to write.
+        "reserved": sum(remaining_bytes(progress) for progress in running),
+        "reserve": disk_reserve,
+    }
+
+
+def has_space(estimate: int, running: List[DownloadProgress]) -> bool:
+    disk = get_disk_status(running)
+    # Only this process's reservations are known, so it may fill just its share of the space above the reserve.
+    return (disk["free"] - disk["reserve"]) // WORKER_PROCESSES - disk["reserved"] - estimate >= 0
+
+
+async def wait_for_space(filename: str, estimate: int, get_running: Callable[[], List[DownloadProgress]]):
+    waiting = False
+    while not has_space(estimate, get_running()):
+        if not waiting:
+            logger.info(f"💾 Not enough free space for {filename} (~{estimate // 1024 ** 2} MiB), holding the queue")
+            waiting = True
+        await asyncio.sleep(DOWNLOAD_DISK_CHECK_INTERVAL)
+    if waiting:
+        logger.info(f"💾 Space available again, starting {filename}")
@@ -0,0 +1,318 @@
+"""
+End-to-end benchmark of the service against local fake upstreams (bench.upstreams).
+
+    python -m bench.e2e [--series 20] [--movies 10] [--webhooks 500] [--output results.json] ...
+
+Two scenarios run on one in-process app, with the real scheduler, scraper, downloader and importer:
+- webhooks: a burst of Sonarr/Radarr add webhooks, then every title is grabbed and imported as in production;
+- sweep: the same number of other titles are put straight into the database and drained by grab_job runs.
+
+Reports webhook throughput and p50/p99 latency, event loop lag, download time to first byte and the time from
+add to import. The last line of output, and --output, hold the results as JSON so runs can be compared.
+Service settings can be overridden through the environment as usual, e.g. GRAB_WORKERS=4 python -m bench.e2e.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+MOVIE_ID_BASE = 100000
+SAMPLE_INTERVAL = 0.01
+
+
+def get_free_ports(count: int) -> list:
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(("127.0.0.1", 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(values: list, scale: float = 1000) -> dict:
+    # Seconds in, milliseconds out by default.
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.5) * scale, 3) if values else None,
+        "p99": round(percentile(values, 0.99) * scale, 3) if values else None,
+        "max": round(max(values) * scale, 3) if values else None,
+    }
+
+
+def configure(args, ports: list, workdir: str):
+    uaserial, sonarr, radarr, tmdb, _ = (f"http://127.0.0.1:{port}" for port in ports)
+    os.environ.update({
+        "HOST": uaserial,
+        "SONARR_URL": sonarr,
+        "RADARR_URL": radarr,
+        "TMDB_BASE_URL": tmdb,
+        "DB_PATH": os.path.join(workdir, "bench.db"),
+        "DOWNLOAD_DIR": os.path.join(workdir, "downloads"),
+        "TMDB_API_KEY": "bench",
+        "SONARR_API_KEY": "bench",
+        "RADARR_API_KEY": "bench",
+    })
+    # Production defaults that would only make the run wait; anything set in the environment wins.
+    for key, value in {"GRAB_DELAY_MINUTES": "0", "INGEST_WINDOW": "0.2", "SCRAPE_RATE": "1000",
+                       "SCRAPE_BURST": "1000", "DOWNLOAD_DISK_RESERVE": "0", "HTTP2_ENABLED": "false"}.items():
+        os.environ.setdefault(key, value)
+
+
+def start_upstreams(args, ports: list) -> subprocess.Popen:
+    command = [sys.executable, "-m", "bench.upstreams", "--ports", ",".join(map(str, ports)),
+               "--series", str(args.series * 2), "--seasons", str(args.seasons), "--episodes", str(args.episodes),
+               "--latency", str(args.latency), "--bandwidth", args.bandwidth, "--segments", str(args.segments),
+               "--segment-size", args.segment_size]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.monotonic() + 30
+    for port in ports:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    process.kill()
+                    raise RuntimeError("fake upstreams did not start")
+                time.sleep(0.1)
+    return process
+
+
+def sonarr_event(series_id: int) -> dict:
+    return {"eventType": "SeriesAdd",
+            "series": {"id": series_id, "title": f"Bench Series {series_id}", "tmdbId": series_id,
+                       "tvdbId": series_id, "imdbId": f"tt{series_id:07d}"}}
+
+
+def radarr_event(number: int) -> dict:
+    movie_id = MOVIE_ID_BASE + number
+    return {"eventType": "MovieAdded",
+            "movie": {"id": movie_id, "title": f"Bench Movie {number}", "tmdbId": movie_id,
+                      "imdbId": f"tt{movie_id:07d}"}}
+
+
+class Sampler:
+    """
+    Wakes up every SAMPLE_INTERVAL to measure event loop lag and to catch the first byte of every download.
+    """
+
+    def __init__(self):
+        self.lag = []
+        self.ttfb = []
+        self.seen = set()
+        self.task = None
+
+    async def run(self):
+        import supervisor
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            self.lag.append(time.perf_counter() - started - SAMPLE_INTERVAL)
+            for progress in list(supervisor.jobs.values()):
+                key = (progress.job_id, progress.started_on)
+                if progress.downloaded_bytes and key not in self.seen:
+                    self.seen.add(key)
+                    self.ttfb.append(time.time() - progress.started_on)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+
+def is_idle() -> bool:
+    import ingest
+    import scheduler
+    flushing = ingest.flush_task is not None and not ingest.flush_task.done()
+    return not (ingest.buffer or flushing or ingest.background_flushes or scheduler.pending_grabs
+                or scheduler.active_titles)
+
+
+async def wait_until_idle(timeout: float):
+    deadline = time.monotonic() + timeout
+    await asyncio.sleep(0.5)
+    while not is_idle():
+        if time.monotonic() > deadline:
+            raise TimeoutError("titles still grabbing after the timeout")
+        await asyncio.sleep(0.1)
+
+
+async def get_imports(ports: list) -> dict:
+    imports = {}
+    async with httpx.AsyncClient() as client:
+        for port in ports[1:3]:
+            response = await client.get(f"http://127.0.0.1:{port}/bench/imports")
+            imports.update({int(key): value for key, value in response.json().items()})
+    return imports
+
+
+async def run_webhooks(app, args, sampler: Sampler) -> dict:
+    events = [("sonarr", series_id, sonarr_event(series_id)) for series_id in range(1, args.series + 1)]
+    events += [("radarr", MOVIE_ID_BASE + number, radarr_event(number)) for number in range(1, args.movies + 1)]
+    # Every title once, then repeats until the burst is full, as Sonarr/Radarr resend and update titles.
+    burst = [events[index % len(events)] for index in range(max(args.webhooks, len(events)))]
+
+    added_on = {}
+    latencies = []
+    failures = 0
+    slots = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def send(source: str, internal_id: int, payload: dict):
+            nonlocal failures
+            async with slots:
+                added_on.setdefault(internal_id, time.time())
+                started = time.perf_counter()
+                response = await client.post(f"/webhook/{source}", json=payload)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    failures += 1
+
+        sampler.lag.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(send(*event) for event in burst))
+        burst_seconds = time.perf_counter() - started
+        # A sample that was starved by the burst only lands once the loop is free again.
+        await asyncio.sleep(SAMPLE_INTERVAL * 2)
+        burst_lag = list(sampler.lag)
+
+        await wait_until_idle(args.timeout)
+        grab_seconds = time.perf_counter() - started
+
+    return {"added_on": added_on, "webhooks": {
+        "requests": len(burst),
+        "failures": failures,
+        "seconds": round(burst_seconds, 3),
+        "throughput": round(len(burst) / burst_seconds, 1),
+        "latency_ms": summarize(latencies),
+        "loop_lag_ms": summarize(burst_lag),
+    }, "grab_seconds": round(grab_seconds, 3)}
+
+
+async def run_sweep(args) -> dict:
+    import database
+    import scheduler
+    from models import MediaData
+
+    created_on = "2000-01-01 00:00:00"
+    items = [(MediaData(internal_id=series_id, created_on=created_on, source_type="SONARR", event_type="SeriesAdd",
+                        imdb_id=None, series_title=f"Bench Series {series_id}", tmdb_id=series_id,
+                        tvdb_id=None, local_title=None), list(range(1, args.seasons + 1)))
+             for series_id in range(args.series + 1, args.series * 2 + 1)]
+    items += [(MediaData(internal_id=MOVIE_ID_BASE + number, created_on=created_on, source_type="RADARR",
+                         event_type="MovieAdded", imdb_id=None, series_title=f"Bench Movie {number}",
+                         tmdb_id=MOVIE_ID_BASE + number, tvdb_id=None, local_title=None), [])
+              for number in range(args.movies + 1, args.movies * 2 + 1)]
+    await database.add_to_db(items)
+
+    started = time.perf_counter()
+    sweep_started_on = time.time()
+    await scheduler.grab_job()
+    sweep_seconds = time.perf_counter() - started
+    await scheduler.grab_queue.join()
+    drain_seconds = time.perf_counter() - started
+    return {"ids": [media.internal_id for media, _ in items], "started_on": sweep_started_on, "sweep": {
+        "titles": len(items),
+        "grab_job_seconds": round(sweep_seconds, 3),
+        "drain_seconds": round(drain_seconds, 3),
+        "titles_per_second": round(len(items) / drain_seconds, 2),
+    }}
+
+
+async def run(args, ports: list) -> dict:
+    import main
+    import supervisor
+
+    sampler = Sampler()
+    async with main.lifespan(main.app):
+        sampler.start()
+        webhooks = await run_webhooks(main.app, args, sampler)
+        sweep = await run_sweep(args)
+        await sampler.stop()
+        downloaded = supervisor.totals["bytes"]
+        finished, failed = supervisor.totals["finished"], supervisor.totals["failed"]
+    imports = await get_imports(ports)
+
+    added_on = webhooks.pop("added_on")
+    end_to_end = [imports[internal_id] - added for internal_id, added in added_on.items() if internal_id in imports]
+    swept = [imports[internal_id] - sweep["started_on"] for internal_id in sweep["ids"] if internal_id in imports]
+    return {
+        "webhooks": webhooks["webhooks"],
+        "end_to_end_ms": {**summarize(end_to_end), "titles": len(added_on), "imported": len(end_to_end),
+                          "seconds": webhooks["grab_seconds"]},
+        "sweep": {**sweep["sweep"], "imported": len(swept), "import_ms": summarize(swept)},
+        "loop_lag_ms": summarize(sampler.lag),
+        "ttfb_ms": summarize(sampler.ttfb),
+        "downloads": {"finished": finished, "failed": failed, "bytes": downloaded},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--series", type=int, default=20, help="series per scenario")
+    parser.add_argument("--movies", type=int, default=10, help="movies per scenario")
+    parser.add_argument("--seasons", type=int, default=1)
+    parser.add_argument("--episodes", type=int, default=3)
+    parser.add_argument("--webhooks", type=int, default=500, help="webhook requests in the burst")
+    parser.add_argument("--concurrency", type=int, default=50, help="webhook requests in flight")
+    parser.add_argument("--latency", type=float, default=20, help="ms before each HLS response")
+    parser.add_argument("--bandwidth", default="0", help="HLS segment rate, e.g. 4M; 0 is unthrottled")
+    parser.add_argument("--segments", type=int, default=5)
+    parser.add_argument("--segment-size", default="256K")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for all grabs")
+    parser.add_argument("--output", help="also write the JSON results here")
+    parser.add_argument("--verbose", action="store_true", help="keep the service's INFO logs")
+    args = parser.parse_args()
+
+    ports = get_free_ports(5)
+    with tempfile.TemporaryDirectory() as workdir:
+        # Settings are read on import, so the environment is set before any service module is loaded.
+        configure(args, ports, workdir)
+        upstreams = start_upstreams(args, ports)
+        try:
+            import logger  # noqa: F401 - installs the service's logging config before it is tuned down
+            if not args.verbose:
+                logging.getLogger().setLevel(logging.WARNING)
+            results = asyncio.run(run(args, ports))
+        finally:
+            upstreams.terminate()
+            upstreams.wait()
+
+    results = {"config": vars(args), **results}
+    webhooks, end_to_end = results["webhooks"], results["end_to_end_ms"]
+    print(f"webhooks    {webhooks['requests']} in {webhooks['seconds']}s, {webhooks['throughput']}/s, "
+          f"p50 {webhooks['latency_ms']['p50']} ms, p99 {webhooks['latency_ms']['p99']} ms")
+    print(f"add→import  {end_to_end['imported']}/{end_to_end['titles']} titles, "
+          f"p50 {end_to_end['p50']} ms, p99 {end_to_end['p99']} ms")
+    print(f"sweep       {results['sweep']['imported']}/{results['sweep']['titles']} titles, "
+          f"{results['sweep']['titles_per_second']}/s")
+    print(f"loop lag    p50 {results['loop_lag_ms']['p50']} ms, p99 {results['loop_lag_ms']['p99']} ms, "
+          f"max {results['loop_lag_ms']['max']} ms")
+    print(f"first byte  p50 {results['ttfb_ms']['p50']} ms, p99 {results['ttfb_ms']['p99']} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of the scraper extractors over the saved pages in bench/fixtures.
+
+    python -m bench.parsers [iterations]
+
+Compares the old full BeautifulSoup tree per page with every installed html_parser backend.
+"""
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+import html_parser
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, f"{name}.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+def full_tree(html, query, limit):
+    soup = BeautifulSoup(html, "html.parser")
+    nodes = soup.select(query.css, limit=limit)
+    if query.attr:
+        return [node.get(query.attr) for node in nodes]
+    return [node.get_text() for node in nodes]
+
+
+CASES = [
+    ("search", html_parser.SEARCH_LINK, 1),
+    ("film", html_parser.LD_JSON, 1),
+    ("season", html_parser.SERIES_OPTIONS, 0),
+    ("film", html_parser.EMBED_IFRAME, 1),
+    ("embed", html_parser.LINK_OPTIONS, 0),
+]
+
+
+def measure(select, html, query, limit, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        select(html, query, limit)
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    backends = {"bs4 full tree": full_tree, **html_parser.BACKENDS}
+    results = []
+
+    for page, query, limit in CASES:
+        html = load(page)
+        expected = full_tree(html, query, limit)
+        baseline = None
+        for name, select in backends.items():
+            assert select(html, query, limit) == expected, f"{name} disagrees on {page}"
+            seconds = measure(select, html, query, limit, iterations)
+            baseline = baseline or seconds
+            results.append({"page": page, "query": query.css, "backend": name,
+                            "ms": round(seconds * 1000, 3), "speedup": round(baseline / seconds, 1)})
+            print(f"{page:8} {name:14} {seconds * 1000:8.3f} ms  x{baseline / seconds:5.1f}  {query.css}")
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Local stand-ins for every upstream the service talks to, for bench.e2e.
+
+    python -m bench.upstreams --ports 9101,9102,9103,9104,9105 [--latency 20] [--bandwidth 4M] ...
+
+Serves, one port each: the uaserial site (the pages in bench/fixtures, rewritten per title), the Sonarr API,
+the Radarr API, the TMDb API and an HLS origin with three mirrors. Sonarr and Radarr record every manual import;
+GET /bench/imports returns them as {id: unix time}.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+
+from admission import parse_size
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+FIXTURE_SLUG = "shchodennyky-vampira"
+LD_JSON = re.compile(r'(<script type="application/ld\+json">)(.*?)(</script>)', re.S)
+# The fixture embed page links these three mirrors; each is served slower than the one before it.
+MIRRORS = {"https://ashdi.vip": ("ashdi", 1), "https://tortuga.wtf": ("tortuga", 2), "https://moon.example": ("moon", 4)}
+HEIGHTS = (480, 720, 1080)
+MOVIE_ID_BASE = 100000
+CHUNK_SIZE = 16 * 1024
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, f"{name}.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+def get_slug(query: str) -> str:
+    # Series searches append the season number: "Bench Series 3 1" -> "bench-series-3".
+    title = re.sub(r"^(.*?\d+) \d+$", r"\1", query.strip())
+    return re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-")
+
+
+def make_segment(size: int) -> bytes:
+    """
+    A real 4 second MPEG-TS segment when ffmpeg is around, so the remux succeeds; null packets otherwise.
+    """
+    if shutil.which("ffmpeg"):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "segment.ts")
+            subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=duration=4:size=640x360",
+                            "-c:v", "mpeg2video", "-b:v", str(size * 2), "-f", "mpegts", path],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if os.path.exists(path) and os.path.getsize(path):
+                with open(path, "rb") as f:
+                    return f.read()
+    packet = b"\x47\x1f\xff\x10" + b"\xff" * 184
+    return packet * max(size // len(packet), 1)
+
+
+def create_uaserial(base: str, hls: str) -> FastAPI:
+    app = FastAPI()
+    pages = {name: load(name) for name in ("search", "film", "season", "embed")}
+
+    def local(html: str, slug: str) -> str:
+        return html.replace("https://uaserial.top", base).replace(FIXTURE_SLUG, slug)
+
+    @app.get("/search")
+    async def search(query: str):
+        return HTMLResponse(local(pages["search"], get_slug(query)))
+
+    @app.get("/embed/{slug}/season-{season}/episode-{episode}")
+    async def embed(slug: str, season: int, episode: int):
+        html = pages["embed"]
+        for origin, (mirror, _) in MIRRORS.items():
+            html = html.replace(origin, f"{hls}/{mirror}")
+        return HTMLResponse(html)
+
+    @app.get("/{slug}/season-{season}/")
+    async def season_page(slug: str, season: int):
+        return HTMLResponse(local(pages["season"], slug))
+
+    @app.get("/{slug}/")
+    async def film(slug: str):
+        html = local(pages["film"], slug)
+        if slug.startswith("bench-movie"):
+            movie = f'{{"@context": "https://schema.org", "@type": "Movie", "name": "{slug}", "url": "{base}/{slug}/"}}'
+            html = LD_JSON.sub(lambda match: match.group(1) + movie + match.group(3), html, count=1)
+        return HTMLResponse(html)
+
+    return app
+
+
+def create_sonarr(series_count: int, seasons: int, episodes: int, overrides: Optional[Dict[tuple, dict]] = None,
+                  episode_files: Optional[List[dict]] = None) -> FastAPI:
+    """
+    Every episode is monitored, aired and missing unless overrides, keyed by (season, episode), says otherwise;
+    episode_files is served as every series' /episodefile.
+    """
+    app = FastAPI()
+    imports = {}
+    aired = "2020-01-01T00:00:00Z"
+    overrides = overrides or {}
+
+    def get_series(series_id: int) -> dict:
+        return {
+            "id": series_id,
+            "title": f"Bench Series {series_id}",
+            "tmdbId": series_id,
+            "seasons": [{"seasonNumber": number, "monitored": True,
+                         "statistics": {"episodeFileCount": 0, "episodeCount": episodes}}
+                        for number in range(1, seasons + 1)],
+        }
+
+    @app.get("/api/v3/series")
+    async def all_series():
+        return [get_series(series_id) for series_id in range(1, series_count + 1)]
+
+    @app.get("/api/v3/series/{series_id}")
+    async def one_series(series_id: int):
+        if not 0 < series_id <= series_count:
+            return JSONResponse({"message": "NotFound"}, status_code=404)
+        return get_series(series_id)
+
+    @app.get("/api/v3/episode")
+    async def episode_list(seriesId: int):
+        return [{"id": seriesId * 10000 + season * 100 + number, "seasonNumber": season, "episodeNumber": number,
+                 "monitored": True, "hasFile": False, "episodeFileId": 0, "airDateUtc": aired,
+                 **overrides.get((season, number), {})}
+                for season in range(1, seasons + 1) for number in range(1, episodes + 1)]
+
+    @app.get("/api/v3/episodefile")
+    async def get_episode_files(seriesId: int):
+        return episode_files or []
+
+    @app.post("/api/v3/manualimport")
+    async def manual_import(request: Request):
+        for item in await request.json():
+            imports[item["seriesId"]] = time.time()
+        return []
+
+    @app.get("/bench/imports")
+    async def get_imports():
+        return imports
+
+    return app
+
+
+def create_radarr() -> FastAPI:
+    app = FastAPI()
+    imports = {}
+
+    @app.post("/api/v3/manualimport")
+    async def manual_import(request: Request):
+        for item in await request.json():
+            imports[item["movieId"]] = time.time()
+        return []
+
+    @app.get("/bench/imports")
+    async def get_imports():
+        return imports
+
+    return app
+
+
+def create_tmdb() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/tv/{tmdb_id}")
+    async def tv(tmdb_id: int):
+        return {"id": tmdb_id, "name": f"Bench Series {tmdb_id}"}
+
+    @app.get("/movie/{tmdb_id}")
+    async def movie(tmdb_id: int):
+        return {"id": tmdb_id, "title": f"Bench Movie {tmdb_id - MOVIE_ID_BASE}"}
+
+    return app
+
+
+def create_hls(latency: float, bandwidth: int, segments: int, segment: bytes) -> FastAPI:
+    app = FastAPI()
+    slowdown = {mirror: factor for mirror, factor in MIRRORS.values()}
+
+    async def pause(mirror: str):
+        await asyncio.sleep(latency * slowdown.get(mirror, 1))
+
+    @app.get("/{mirror}/vod/{video_id}")
+    async def master(mirror: str, video_id: str):
+        await pause(mirror)
+        lines = ["#EXTM3U"]
+        for height in HEIGHTS:
+            lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={height * 2500},RESOLUTION={height * 16 // 9}x{height}")
+            lines.append(f"/{mirror}/vod/{video_id}/{height}/index.m3u8")
+        return PlainTextResponse("\n".join(lines) + "\n", media_type="application/vnd.apple.mpegurl")
+
+    @app.get("/{mirror}/vod/{video_id}/{height}/index.m3u8")
+    async def media(mirror: str, video_id: str, height: int):
+        await pause(mirror)
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:4", "#EXT-X-PLAYLIST-TYPE:VOD"]
+        for number in range(segments):
+            lines += ["#EXTINF:4.0,", f"seg{number}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return PlainTextResponse("\n".join(lines) + "\n", media_type="application/vnd.apple.mpegurl")
+
+    @app.get("/{mirror}/vod/{video_id}/{height}/seg{number}.ts")
+    async def media_segment(mirror: str, video_id: str, height: int, number: int):
+        await pause(mirror)
+        rate = bandwidth / slowdown.get(mirror, 1) if bandwidth else 0
+
+        async def body():
+            for offset in range(0, len(segment), CHUNK_SIZE):
+                chunk = segment[offset:offset + CHUNK_SIZE]
+                if rate:
+                    await asyncio.sleep(len(chunk) / rate)
+                yield chunk
+
+        return StreamingResponse(body(), media_type="video/mp2t", headers={"Content-Length": str(len(segment))})
+
+    return app
+
+
+async def serve(apps):
+    servers = [uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+               for port, app in apps]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ports", required=True, help="uaserial,sonarr,radarr,tmdb,hls")
+    parser.add_argument("--series", type=int, default=20)
+    parser.add_argument("--seasons", type=int, default=1)
+    parser.add_argument("--episodes", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=20, help="ms before each HLS response on the fastest mirror")
+    parser.add_argument("--bandwidth", default="0", help="per-segment HLS rate on the fastest mirror, e.g. 4M")
+    parser.add_argument("--segments", type=int, default=5)
+    parser.add_argument("--segment-size", default="256K")
+    args = parser.parse_args()
+    # Probes hang up after the first chunk of a segment, which asyncio reports on every later write.
+    logging.getLogger("asyncio").setLevel(logging.ERROR)
+
+    uaserial_port, sonarr_port, radarr_port, tmdb_port, hls_port = map(int, args.ports.split(","))
+    segment = make_segment(parse_size(args.segment_size))
+    asyncio.run(serve([
+        (uaserial_port, create_uaserial(f"http://127.0.0.1:{uaserial_port}", f"http://127.0.0.1:{hls_port}")),
+        (sonarr_port, create_sonarr(args.series, args.seasons, args.episodes)),
+        (radarr_port, create_radarr()),
+        (tmdb_port, create_tmdb()),
+        (hls_port, create_hls(args.latency / 1000, parse_size(args.bandwidth), args.segments, segment)),
+    ]))
+
+
+if __name__ == "__main__":
+    main()
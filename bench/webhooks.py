@@ -0,0 +1,101 @@
+"""
+Micro-benchmark of the webhook decode path, in events per second on one core.
+
+    python -m bench.webhooks [iterations]
+
+Compares the old path (body to text, json.loads into dicts, an async mapper building a validated MediaData)
+with every installed events decoder followed by to_media_data. Each rate is the best of five runs in CPU time.
+"""
+import json
+import sys
+import time
+from datetime import datetime
+
+import events
+from models import MediaData
+
+SERIES = {"id": 42, "title": "Shchodennyky vampira", "titleSlug": "shchodennyky-vampira", "path": "/tv/Shchodennyky",
+          "tvdbId": 95491, "tvMazeId": 1, "tmdbId": 1405, "imdbId": "tt1405406", "type": "standard", "year": 2009,
+          "genres": ["Drama", "Fantasy", "Horror", "Romance"], "tags": [], "language": "English",
+          "images": [{"coverType": "poster", "url": "/MediaCover/42/poster.jpg"}]}
+MOVIE = {"id": 7, "title": "Dune: Part Two", "year": 2024, "releaseDate": "2024-03-01", "folderPath": "/movies/Dune",
+         "tmdbId": 693134, "imdbId": "tt15239678", "overview": "Paul Atreides unites with Chani and the Fremen " * 4,
+         "genres": ["Science Fiction", "Adventure"], "tags": [], "originalLanguage": {"id": 1, "name": "English"}}
+RELEASE = {"quality": "WEBDL-1080p", "qualityVersion": 1, "releaseGroup": "NTb", "releaseTitle": "Release.1080p.WEB",
+           "indexer": "Indexer", "size": 3500000000, "customFormatScore": 0, "customFormats": ["x264", "Surround"]}
+EPISODES = [{"id": 1000 + number, "episodeNumber": number, "seasonNumber": 1, "title": f"Episode {number}",
+             "overview": "An episode overview long enough to look like the real thing. " * 3,
+             "airDate": "2009-09-10", "airDateUtc": "2009-09-11T00:00:00Z", "seriesId": 42, "tvdbId": 5000 + number}
+            for number in range(1, 23)]
+
+PAYLOADS = [
+    ("sonarr SeriesAdd", "SONARR", {"eventType": "SeriesAdd", "series": SERIES, "instanceName": "Sonarr",
+                                    "applicationUrl": ""}),
+    ("sonarr Download", "SONARR", {"eventType": "Download", "series": SERIES, "episodes": EPISODES,
+                                   "episodeFile": {"id": 9, "relativePath": "Season 01/S01E01.mkv", "size": 1 << 30,
+                                                   "quality": "WEBDL-1080p", "mediaInfo": {"videoCodec": "x264"}},
+                                   "release": RELEASE, "isUpgrade": False, "downloadClient": "qBittorrent",
+                                   "downloadId": "A" * 40, "customFormatInfo": {"customFormats": [], "score": 0}}),
+    ("radarr MovieAdded", "RADARR", {"eventType": "MovieAdded", "movie": MOVIE, "addMethod": "manual",
+                                     "instanceName": "Radarr", "applicationUrl": ""}),
+    ("radarr Grab", "RADARR", {"eventType": "Grab", "movie": MOVIE, "remoteMovie": {"tmdbId": 693134,
+                                                                                   "title": "Dune Part Two"},
+                               "release": RELEASE, "downloadClient": "qBittorrent", "downloadId": "B" * 40}),
+]
+
+
+async def map_response(body_json, source_type) -> MediaData:
+    title = body_json.get("series" if source_type == "SONARR" else "movie", {})
+    return MediaData(internal_id=title.get("id"), created_on=str(datetime.now()), source_type=source_type,
+                     event_type=body_json.get("eventType"), imdb_id=title.get("imdbId"),
+                     series_title=title.get("title"), tmdb_id=title.get("tmdbId"), tvdb_id=title.get("tvdbId"),
+                     local_title=None)
+
+
+def old_path(body: bytes, source_type: str) -> MediaData:
+    body_json = json.loads(body.decode("utf-8", errors="replace"))
+    coroutine = map_response(body_json, source_type)
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+def decoder_path(decode):
+    def path(body: bytes, source_type: str) -> MediaData:
+        return events.to_media_data(decode(body), source_type)
+    return path
+
+
+def measure(path, body, source_type, iterations, repeats=5):
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.process_time()
+        for _ in range(iterations):
+            path(body, source_type)
+        best = min(best, time.process_time() - started)
+    return iterations / best
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    paths = {"old json+pydantic": old_path, **{name: decoder_path(decode) for name, decode in events.DECODERS.items()}}
+    results = []
+
+    for case, source_type, payload in PAYLOADS:
+        body = json.dumps(payload).encode()
+        expected = old_path(body, source_type).model_dump(exclude={"created_on"})
+        baseline = None
+        for name, path in paths.items():
+            assert path(body, source_type).model_dump(exclude={"created_on"}) == expected, f"{name} disagrees on {case}"
+            rate = measure(path, body, source_type, iterations)
+            baseline = baseline or rate
+            results.append({"payload": case, "bytes": len(body), "decoder": name,
+                            "events_per_second": round(rate), "speedup": round(rate / baseline, 1)})
+            print(f"{case:18} {len(body):6} B  {name:18} {rate:10.0f} events/s  x{rate / baseline:4.1f}")
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
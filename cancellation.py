@@ -0,0 +1,34 @@
+import asyncio
+from typing import Optional, Set
+
+
+class CancelToken:
+    """
+    Cancels one title or one episode; cancelling a title cancels all of its episodes.
+    The reason tells the owner what to do with the interrupted work: "cancelled", "paused" or "stopped".
+    """
+
+    def __init__(self, parent: Optional["CancelToken"] = None):
+        self.parent = parent
+        self.children: Set["CancelToken"] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.reason: Optional[str] = None
+        if parent is not None:
+            parent.children.add(self)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = "cancelled"):
+        if self.reason is None:
+            self.reason = reason
+        for child in list(self.children):
+            child.cancel(reason)
+        # Cancelling the task releases its download slots right away and kills its yt-dlp.
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def close(self):
+        if self.parent is not None:
+            self.parent.children.discard(self)
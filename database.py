@@ -1,93 +1,270 @@
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import sqlite3
-from typing import List
+import time
+from typing import Dict, List, Optional, Tuple
+import migrations
 from models import MediaData
-from settings import DB_PATH
+from settings import (DB_PATH, DB_BUSY_TIMEOUT, DB_JOURNAL_MODE, DOWNLOAD_MAX_ATTEMPTS, DOWNLOAD_RETRY_BACKOFF,
+                      GRAB_MAX_ATTEMPTS, GRAB_RETRY_BACKOFF)
 from logger import get_logger
 
 logger = get_logger(__name__)
 
+# All SQLite work runs on this one thread against one long-lived connection,
+# so the event loop never blocks on disk I/O and writes never race each other.
+db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+connection: Optional[sqlite3.Connection] = None
+
+
+def get_connection() -> sqlite3.Connection:
+    global connection
+    if connection is None:
+        connection = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, cached_statements=256)
+        connection.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+        # NORMAL is only crash safe with WAL; a rollback journal needs FULL.
+        connection.execute(f"PRAGMA synchronous = {'NORMAL' if DB_JOURNAL_MODE == 'WAL' else 'FULL'}")
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}")
+    return connection
+
+
+def repository(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(db_executor, lambda: func(get_connection(), *args, **kwargs))
+    return wrapper
+
+
+@repository
+def close_db(conn: sqlite3.Connection):
+    global connection
+    conn.close()
+    connection = None
 
-def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS media_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT UNIQUE,
-                source_type TEXT NOT NULL,
-                internal_id INTEGER UNIQUE,
-                created_on TIMESTAMP,
-                local_title TEXT,
-                tmdbId INTEGER UNIQUE,
-                imdbId TEXT UNIQUE,
-                tvdbId INTEGER UNIQUE
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS monitored_seasons (
-                internal_id INTEGER,
-                season_number INTEGER,
-                PRIMARY KEY (internal_id, season_number),
-                FOREIGN KEY (internal_id) REFERENCES media_data(internal_id)
-            )
-        """)
-        conn.commit()
 
+@repository
+def init_db(conn: sqlite3.Connection):
+    migrations.migrate(conn)
 
-def add_to_db(media_data: MediaData, monitored_seasons):
-    with sqlite3.connect(DB_PATH) as conn:
+
+@repository
+def maintain_db(conn: sqlite3.Connection):
+    now = time.time()
+    with conn:
+        pages = conn.execute("DELETE FROM page_cache WHERE expires_on <= ?", (now,)).rowcount
+        titles = conn.execute("DELETE FROM title_cache WHERE expires_on <= ?", (now,)).rowcount
+    # VACUUM cannot run inside a transaction, so it goes after the cleanup commit.
+    conn.execute("VACUUM")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    logger.info(f"[DB] Maintenance done, removed {pages} expired pages and {titles} expired titles.")
+
+
+@repository
+def add_to_db(conn: sqlite3.Connection, items: List[Tuple[MediaData, List[int]]]) -> int:
+    """
+    Inserts a batch of titles with their monitored seasons in one transaction.
+    Titles that already exist are skipped, together with their seasons.
+    """
+    with conn:
         cursor = conn.cursor()
-        cursor.execute("PRAGMA foreign_keys = ON")
-        try:
-            cursor.execute("""
-                INSERT INTO media_data (internal_id, title, source_type, created_on, tmdbId, imdbId, tvdbId, local_title)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (media_data.internal_id, media_data.series_title, media_data.source_type, media_data.created_on,
-                  media_data.tmdb_id, media_data.imdb_id, media_data.tvdb_id, media_data.local_title))
-            for season in monitored_seasons:
-                cursor.execute("""
-                    INSERT INTO monitored_seasons (internal_id, season_number)
-                    VALUES (?, ?)
-                """, (media_data.internal_id, season))
-            conn.commit()
-        except sqlite3.IntegrityError:
-            logger.info(f"{media_data.series_title} already exists. Skipping insert.")
-
-
-def delete_from_db_by_ids(internal_id: int = None, tmdb_id: int = None, imdb_id: str = None, tvdb_id: int = None):
-    with sqlite3.connect(DB_PATH) as conn:
+        before = conn.total_changes
+        cursor.executemany("""
+            INSERT OR IGNORE INTO media_data (internal_id, title, source_type, created_on, tmdbId, imdbId, tvdbId,
+                                              local_title)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(media_data.internal_id, media_data.series_title, media_data.source_type, media_data.created_on,
+               media_data.tmdb_id, media_data.imdb_id, media_data.tvdb_id, media_data.local_title)
+              for media_data, _ in items])
+        inserted = conn.total_changes - before
+        # Only rows inserted by this batch carry its created_on, so existing titles keep their seasons.
+        cursor.executemany("""
+            INSERT OR IGNORE INTO monitored_seasons (internal_id, season_number)
+            SELECT ?, ? WHERE EXISTS (SELECT 1 FROM media_data WHERE internal_id = ? AND created_on = ?)
+        """, [(media_data.internal_id, season, media_data.internal_id, media_data.created_on)
+              for media_data, seasons in items for season in seasons])
+    if inserted < len(items):
+        logger.info(f"{len(items) - inserted} of {len(items)} titles already exist. Skipping insert.")
+    return inserted
+
+
+@repository
+def delete_from_db_by_ids(conn: sqlite3.Connection, internal_id: int = None, tmdb_id: int = None, imdb_id: str = None,
+                          tvdb_id: int = None):
+    if tmdb_id:
+        column, value = "tmdbId", tmdb_id
+    elif imdb_id:
+        column, value = "imdbId", imdb_id
+    elif tvdb_id:
+        column, value = "tvdbId", tvdb_id
+    elif internal_id:
+        column, value = "internal_id", internal_id
+    else:
+        return
+
+    with conn:
         cursor = conn.cursor()
-        if tmdb_id:
-            cursor.execute("DELETE FROM media_data WHERE tmdbId = ?", (tmdb_id,))
-        elif imdb_id:
-            cursor.execute("DELETE FROM media_data WHERE imdbId = ?", (imdb_id,))
-        elif tvdb_id:
-            cursor.execute("DELETE FROM media_data WHERE tvdbId = ?", (tvdb_id,))
-        elif internal_id:
-            cursor.execute("DELETE FROM media_data WHERE internal_id = ?", (internal_id,))
-        conn.commit()
-
-
-def get_media_added_more_than(minutes_ago: int) -> List[MediaData]:
+        cursor.execute(f"DELETE FROM media_data WHERE {column} = ?", (value,))
+        if internal_id:
+            cursor.execute("DELETE FROM download_jobs WHERE internal_id = ?", (internal_id,))
+
+
+# A title is due once its own retry time has passed, unless it failed for good or has unfinished episodes and none
+# of them may be retried yet; grabbing it earlier would only repeat the scrape and probes.
+# Takes the current time, DOWNLOAD_MAX_ATTEMPTS twice and the current time again.
+DUE_TITLE = """
+    m.status != 'failed' AND m.next_attempt_on <= ? AND
+    (NOT EXISTS (SELECT 1 FROM download_jobs j
+                 WHERE j.internal_id = m.internal_id AND j.state NOT IN ('done', 'cancelled') AND j.attempts < ?)
+     OR EXISTS (SELECT 1 FROM download_jobs j
+                WHERE j.internal_id = m.internal_id AND j.state IN ('pending', 'failed') AND j.attempts < ?
+                  AND j.next_attempt_on <= ?))
+"""
+
+
+@repository
+def get_media_added_more_than(conn: sqlite3.Connection, minutes_ago: float) -> List[MediaData]:
     cutoff_time = datetime.now() - timedelta(minutes=minutes_ago)
     cutoff_str = cutoff_time.strftime("%Y-%m-%d %H:%M:%S")
 
-    with sqlite3.connect(DB_PATH) as conn:
+    with conn:
         cursor = conn.cursor()
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT id, title, created_on, tmdbId, imdbId, tvdbId, internal_id, local_title, source_type
-            FROM media_data
-            WHERE created_on <= ?
-        """, (cutoff_str,))
+            FROM media_data m
+            WHERE created_on <= ? AND {DUE_TITLE}
+        """, (cutoff_str, time.time(), DOWNLOAD_MAX_ATTEMPTS, DOWNLOAD_MAX_ATTEMPTS, time.time()))
 
         media_list = [map_media(row) for row in cursor.fetchall()]
 
     return media_list
 
 
-def get_monitored_seasons(internal_id: int):
-    with sqlite3.connect(DB_PATH) as conn:
+@repository
+def set_media_status(conn: sqlite3.Connection, internal_id: int, status: str):
+    with conn:
+        conn.execute("UPDATE media_data SET status = ? WHERE internal_id = ?", (status, internal_id))
+
+
+@repository
+def finish_title_attempt(conn: sqlite3.Connection, internal_id: int, failed: bool) -> Optional[str]:
+    """
+    Leaves a title that still has work "retrying"; a failed grab backs off like an episode and, after
+    GRAB_MAX_ATTEMPTS in a row, marks the title "failed". Returns the new status.
+    """
+    with conn:
+        if failed:
+            cursor = conn.execute("""
+                UPDATE media_data
+                SET attempts = attempts + 1, next_attempt_on = ? + ? * (1 << attempts),
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'retrying' END
+                WHERE internal_id = ?
+                RETURNING status
+            """, (time.time(), GRAB_RETRY_BACKOFF, GRAB_MAX_ATTEMPTS, internal_id))
+        else:
+            cursor = conn.execute("""
+                UPDATE media_data SET attempts = 0, next_attempt_on = 0, status = 'retrying' WHERE internal_id = ?
+                RETURNING status
+            """, (internal_id,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@repository
+def media_exists(conn: sqlite3.Connection, internal_id: int) -> bool:
+    with conn:
+        cursor = conn.execute("SELECT 1 FROM media_data WHERE internal_id = ?", (internal_id,))
+        return cursor.fetchone() is not None
+
+
+def requeue_title_jobs(conn: sqlite3.Connection, internal_id: int):
+    # Whoever held the title before is gone, so its running episodes are not running anymore.
+    conn.execute("""
+        UPDATE download_jobs SET state = 'pending', attempts = MAX(attempts - 1, 0)
+        WHERE internal_id = ? AND state = 'running'
+    """, (internal_id,))
+
+
+@repository
+def claim_title(conn: sqlite3.Connection, worker: str, lease_seconds: float, internal_id: int) -> bool:
+    """
+    Leases a title for grabbing unless another worker holds it. Missing titles can't be claimed.
+    """
+    now = time.time()
+    with conn:
+        cursor = conn.execute("""
+            UPDATE media_data SET worker = ?, lease_expires_on = ?
+            WHERE internal_id = ? AND (worker IS NULL OR worker = ? OR lease_expires_on <= ?)
+        """, (worker, now + lease_seconds, internal_id, worker, now))
+        if not cursor.rowcount:
+            return False
+        requeue_title_jobs(conn, internal_id)
+    return True
+
+
+@repository
+def claim_next_title(conn: sqlite3.Connection, worker: str, lease_seconds: float,
+                     minutes_ago: float) -> Optional[MediaData]:
+    """
+    Leases the next title due for grabbing, in the order the scheduler queues them:
+    movies first, then series by number of monitored seasons, oldest first within each group.
+    """
+    now = time.time()
+    cutoff_str = (datetime.now() - timedelta(minutes=minutes_ago)).strftime("%Y-%m-%d %H:%M:%S")
+    with conn:
+        # One statement, so two workers can never both see the title as free.
+        cursor = conn.execute(f"""
+            UPDATE media_data SET worker = ?, lease_expires_on = ?
+            WHERE id = (
+                SELECT m.id FROM media_data m
+                WHERE m.created_on <= ? AND m.lease_expires_on <= ? AND {DUE_TITLE}
+                ORDER BY m.source_type = 'SONARR',
+                         (SELECT COUNT(*) FROM monitored_seasons s WHERE s.internal_id = m.internal_id),
+                         m.created_on, m.id
+                LIMIT 1
+            )
+            RETURNING id, title, created_on, tmdbId, imdbId, tvdbId, internal_id, local_title, source_type
+        """, (worker, now + lease_seconds, cutoff_str, now, now, DOWNLOAD_MAX_ATTEMPTS, DOWNLOAD_MAX_ATTEMPTS, now))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        requeue_title_jobs(conn, row[6])
+    return map_media(row)
+
+
+@repository
+def renew_title_leases(conn: sqlite3.Connection, worker: str, internal_ids: List[int],
+                       lease_seconds: float) -> List[int]:
+    """
+    Extends the worker's leases and returns the titles it still holds.
+    """
+    placeholders = ", ".join("?" * len(internal_ids))
+    with conn:
+        cursor = conn.execute(f"""
+            UPDATE media_data SET lease_expires_on = ?
+            WHERE worker = ? AND internal_id IN ({placeholders})
+            RETURNING internal_id
+        """, (time.time() + lease_seconds, worker, *internal_ids))
+        return [row[0] for row in cursor.fetchall()]
+
+
+@repository
+def release_title(conn: sqlite3.Connection, worker: str, internal_id: int, retry_after: float = 0):
+    # The lease expiry doubles as the earliest time the next worker may claim the title again.
+    with conn:
+        conn.execute("""
+            UPDATE media_data SET worker = NULL, lease_expires_on = ? WHERE internal_id = ? AND worker = ?
+        """, (time.time() + retry_after, internal_id, worker))
+
+
+@repository
+def get_monitored_seasons(conn: sqlite3.Connection, internal_id: int):
+    with conn:
         cursor = conn.cursor()
         cursor.execute("""
                 SELECT season_number FROM monitored_seasons WHERE internal_id = ? ORDER BY season_number
@@ -96,34 +273,307 @@ def get_monitored_seasons(internal_id: int):
         return [season[0] for season in seasons_rows]
 
 
-def get_all_data():
-    with sqlite3.connect(DB_PATH) as conn:
+@repository
+def get_all_data(conn: sqlite3.Connection, after_id: int = None, limit: int = None, source_type: str = None,
+                 created_from: str = None, created_to: str = None, has_local_title: bool = None) -> List[dict]:
+    conditions, params = [], []
+    if after_id is not None:
+        conditions.append("m.id > ?")
+        params.append(after_id)
+    if source_type:
+        conditions.append("m.source_type = ?")
+        params.append(source_type)
+    if created_from:
+        conditions.append("m.created_on >= ?")
+        params.append(created_from)
+    if created_to:
+        conditions.append("m.created_on <= ?")
+        params.append(created_to)
+    if has_local_title is not None:
+        conditions.append("m.local_title IS NOT NULL" if has_local_title else "m.local_title IS NULL")
+
+    query = f"""
+        SELECT m.id, m.title, m.created_on, m.tmdbId, m.imdbId, m.tvdbId, m.internal_id, m.local_title, m.source_type,
+               group_concat(s.season_number), m.status, m.worker
+        FROM media_data m
+        LEFT JOIN monitored_seasons s ON s.internal_id = m.internal_id
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        GROUP BY m.id
+        ORDER BY m.id
+        {"LIMIT ?" if limit else ""}
+    """
+    if limit:
+        params.append(limit)
+
+    with conn:
+        rows = conn.execute(query, params).fetchall()
+
+    return [{
+        "id": row[0],
+        "title": row[1],
+        "created_on": row[2],
+        "tmdbId": row[3],
+        "imdbId": row[4],
+        "tvdbId": row[5],
+        "localTitle": row[7],
+        "sourceType": row[8],
+        "monitored_seasons": sorted(int(season) for season in row[9].split(",")) if row[9] else [],
+        "status": row[10],
+        "worker": row[11]
+    } for row in rows]
+
+
+async def stream_all_data(batch_size: int = 500, **filters):
+    # Keyset pagination keeps memory flat however many titles are tracked.
+    after_id = filters.pop("after_id", None)
+    limit = filters.pop("limit", None)
+    while limit is None or limit > 0:
+        batch = await get_all_data(after_id=after_id, limit=min(batch_size, limit or batch_size), **filters)
+        for media in batch:
+            yield media
+        if len(batch) < batch_size:
+            return
+        after_id = batch[-1]["id"]
+        if limit is not None:
+            limit -= len(batch)
+
+
+@repository
+def get_cached_titles(conn: sqlite3.Connection,
+                      keys: List[Tuple[int, str, str]]) -> Dict[Tuple[int, str, str], Tuple[Optional[str], float]]:
+    cached = {}
+    now = time.time()
+    with conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT id, title, created_on, tmdbId, imdbId, tvdbId, internal_id, local_title, source_type "
-                       "FROM media_data")
-        rows = cursor.fetchall()
+        # Three bound parameters per key, chunked to stay under SQLite's variable limit.
+        for start in range(0, len(keys), 300):
+            chunk = keys[start:start + 300]
+            cursor.execute(f"""
+                SELECT tmdb_id, media_type, language, title, expires_on
+                FROM title_cache
+                WHERE (tmdb_id, media_type, language) IN (VALUES {", ".join(["(?, ?, ?)"] * len(chunk))})
+                  AND expires_on > ?
+            """, [value for key in chunk for value in key] + [now])
+            cached.update({(row[0], row[1], row[2]): (row[3], row[4]) for row in cursor.fetchall()})
+    return cached
 
-        media_list = []
-        for row in rows:
-            cursor.execute("""
-                SELECT season_number FROM monitored_seasons WHERE internal_id = ? ORDER BY season_number
-            """, (row[6],))
-            seasons_rows = cursor.fetchall()
-            monitored_seasons = [season[0] for season in seasons_rows]
-
-            media_list.append({
-                "id": row[0],
-                "title": row[1],
-                "created_on": row[2],
-                "tmdbId": row[3],
-                "imdbId": row[4],
-                "tvdbId": row[5],
-                "localTitle": row[7],
-                "sourceType": row[8],
-                "monitored_seasons": monitored_seasons
-            })
 
-    return media_list
+@repository
+def save_cached_title(conn: sqlite3.Connection, tmdb_id: int, media_type: str, language: str, title: Optional[str],
+                      expires_on: float):
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO title_cache (tmdb_id, media_type, language, title, expires_on)
+            VALUES (?, ?, ?, ?, ?)
+        """, (tmdb_id, media_type, language, title, expires_on))
+
+
+@repository
+def get_cached_page(conn: sqlite3.Connection, url: str) -> Optional[dict]:
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT body, etag, last_modified, expires_on FROM page_cache WHERE url = ?", (url,))
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return {"body": row[0], "etag": row[1], "last_modified": row[2], "expires_on": row[3]}
+
+
+@repository
+def save_cached_page(conn: sqlite3.Connection, url: str, page_type: str, body: str, etag: Optional[str],
+                     last_modified: Optional[str], expires_on: float):
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO page_cache (url, page_type, body, etag, last_modified, expires_on)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (url, page_type, body, etag, last_modified, expires_on))
+
+
+@repository
+def touch_cached_page(conn: sqlite3.Connection, url: str, expires_on: float):
+    with conn:
+        conn.execute("UPDATE page_cache SET expires_on = ? WHERE url = ?", (expires_on, url))
+
+
+@repository
+def enqueue_download_jobs(conn: sqlite3.Connection, internal_id: int, season: Optional[int],
+                          episodes: List[Tuple[Optional[int], str, str, Optional[int], List[Tuple[str, Optional[int]]]]]):
+    # A rescrape refreshes the sources of unfinished jobs but never resets their progress.
+    # A title deleted while it was being scraped gets no jobs.
+    with conn:
+        conn.executemany("""
+            INSERT INTO download_jobs (internal_id, season, episode, url, filename, height, alternatives, updated_on)
+            SELECT ?, ?, ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM media_data WHERE internal_id = ?)
+            ON CONFLICT (filename) DO UPDATE SET
+                url = excluded.url, height = excluded.height, alternatives = excluded.alternatives
+            WHERE state != 'done'
+        """, [(internal_id, season, episode, url, filename, height, json.dumps(alternatives), str(datetime.now()),
+               internal_id)
+              for episode, url, filename, height, alternatives in episodes])
+
+
+@repository
+def claim_download_job(conn: sqlite3.Connection, internal_id: int, season: Optional[int]) \
+        -> Optional[Tuple[int, str, str, Optional[int], Optional[int], List[Tuple[str, Optional[int]]]]]:
+    with conn:
+        cursor = conn.execute("""
+            UPDATE download_jobs SET state = 'running', attempts = attempts + 1, requested_state = NULL, updated_on = ?
+            WHERE id = (
+                SELECT id FROM download_jobs
+                WHERE internal_id = ? AND season IS ? AND state IN ('pending', 'failed')
+                  AND attempts < ? AND next_attempt_on <= ?
+                ORDER BY episode
+                LIMIT 1
+            )
+            RETURNING id, url, filename, episode, height, alternatives
+        """, (str(datetime.now()), internal_id, season, DOWNLOAD_MAX_ATTEMPTS, time.time()))
+        job = cursor.fetchone()
+    if job is None:
+        return None
+    return *job[:5], [tuple(alternative) for alternative in json.loads(job[5] or "[]")]
+
+
+@repository
+def set_download_job_source(conn: sqlite3.Connection, job_id: int, url: str, height: Optional[int],
+                            alternatives: List[Tuple[str, Optional[int]]]):
+    # The job's url is always the source its partial file came from.
+    with conn:
+        conn.execute("""
+            UPDATE download_jobs SET url = ?, height = ?, alternatives = ?, updated_on = ? WHERE id = ?
+        """, (url, height, json.dumps(alternatives), str(datetime.now()), job_id))
+
+
+@repository
+def finish_download_job(conn: sqlite3.Connection, job_id: int, success: bool, size: Optional[int],
+                        error: Optional[str] = None):
+    with conn:
+        if success:
+            conn.execute("""
+                UPDATE download_jobs SET state = 'done', bytes = ?, error = NULL, updated_on = ? WHERE id = ?
+            """, (size, str(datetime.now()), job_id))
+        else:
+            conn.execute("""
+                UPDATE download_jobs
+                SET state = 'failed', bytes = ?, error = ?, updated_on = ?,
+                    next_attempt_on = ? + ? * (1 << (attempts - 1))
+                WHERE id = ?
+            """, (size, error, str(datetime.now()), time.time(), DOWNLOAD_RETRY_BACKOFF, job_id))
+
+
+@repository
+def release_download_job(conn: sqlite3.Connection, job_id: int, state: str = "pending"):
+    with conn:
+        conn.execute("""
+            UPDATE download_jobs SET state = ?, attempts = MAX(attempts - 1, 0), updated_on = ? WHERE id = ?
+        """, (state, str(datetime.now()), job_id))
+
+
+@repository
+def set_download_job_state(conn: sqlite3.Connection, job_id: int, state: str, from_states: Tuple[str, ...]) -> bool:
+    placeholders = ", ".join("?" * len(from_states))
+    with conn:
+        cursor = conn.execute(f"""
+            UPDATE download_jobs SET state = ?, next_attempt_on = 0, updated_on = ?
+            WHERE id = ? AND state IN ({placeholders})
+        """, (state, str(datetime.now()), job_id, *from_states))
+    return cursor.rowcount > 0
+
+
+@repository
+def request_download_job_state(conn: sqlite3.Connection, job_id: int, state: str) -> bool:
+    # The worker running the job applies it on its next lease renewal.
+    with conn:
+        cursor = conn.execute("""
+            UPDATE download_jobs SET requested_state = ?, updated_on = ? WHERE id = ? AND state = 'running'
+        """, (state, str(datetime.now()), job_id))
+    return cursor.rowcount > 0
+
+
+@repository
+def get_requested_job_states(conn: sqlite3.Connection, job_ids: List[int]) -> Dict[int, str]:
+    placeholders = ", ".join("?" * len(job_ids))
+    with conn:
+        return dict(conn.execute(f"""
+            SELECT id, requested_state FROM download_jobs
+            WHERE id IN ({placeholders}) AND state = 'running' AND requested_state IS NOT NULL
+        """, job_ids).fetchall())
+
+
+@repository
+def requeue_running_jobs(conn: sqlite3.Connection):
+    with conn:
+        # The interrupted attempt was not the job's fault, so it is not counted.
+        # Titles leased by a live worker are still downloading there.
+        cursor = conn.execute("""
+            UPDATE download_jobs SET state = 'pending', attempts = MAX(attempts - 1, 0)
+            WHERE state = 'running' AND internal_id NOT IN (
+                SELECT internal_id FROM media_data
+                WHERE internal_id IS NOT NULL AND worker IS NOT NULL AND lease_expires_on > ?
+            )
+        """, (time.time(),))
+    if cursor.rowcount:
+        logger.info(f"Requeued {cursor.rowcount} interrupted download jobs.")
+
+
+@repository
+def get_done_jobs(conn: sqlite3.Connection, internal_id: int,
+                  season: Optional[int]) -> List[Tuple[Optional[int], str, Optional[int]]]:
+    with conn:
+        return conn.execute("""
+            SELECT episode, filename, height FROM download_jobs
+            WHERE internal_id = ? AND season IS ? AND state = 'done'
+        """, (internal_id, season)).fetchall()
+
+
+@repository
+def get_average_job_size(conn: sqlite3.Connection, internal_id: int) -> Optional[int]:
+    with conn:
+        cursor = conn.execute("""
+            SELECT AVG(bytes) FROM download_jobs WHERE internal_id = ? AND state = 'done' AND bytes > 0
+        """, (internal_id,))
+        size = cursor.fetchone()[0]
+    return int(size) if size else None
+
+
+@repository
+def get_host_health(conn: sqlite3.Connection) -> List[Tuple[str, Optional[float], float, int, float]]:
+    with conn:
+        return conn.execute("SELECT host, latency, error_rate, samples, updated_on FROM host_health").fetchall()
+
+
+@repository
+def save_host_health(conn: sqlite3.Connection, rows: List[Tuple[str, Optional[float], float, int, float]]):
+    with conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO host_health (host, latency, error_rate, samples, updated_on) VALUES (?, ?, ?, ?, ?)
+        """, rows)
+
+
+@repository
+def get_next_attempt_on(conn: sqlite3.Connection, internal_id: int) -> Optional[float]:
+    """
+    When the title is due again: after its own backoff and its earliest retryable episode. None if neither is set.
+    """
+    with conn:
+        row = conn.execute("""
+            SELECT m.next_attempt_on, (SELECT MIN(j.next_attempt_on) FROM download_jobs j
+                                       WHERE j.internal_id = m.internal_id AND j.state IN ('pending', 'failed')
+                                         AND j.attempts < ?)
+            FROM media_data m WHERE m.internal_id = ?
+        """, (DOWNLOAD_MAX_ATTEMPTS, internal_id)).fetchone()
+    if row is None or (not row[0] and row[1] is None):
+        return None
+    return max(row[0], row[1] or 0)
+
+
+@repository
+def count_unfinished_jobs(conn: sqlite3.Connection, internal_id: int) -> int:
+    with conn:
+        cursor = conn.execute("""
+            SELECT COUNT(*) FROM download_jobs
+            WHERE internal_id = ? AND state NOT IN ('done', 'cancelled') AND attempts < ?
+        """, (internal_id, DOWNLOAD_MAX_ATTEMPTS))
+        return cursor.fetchone()[0]
 
 
 def map_media(row) -> MediaData:
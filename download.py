@@ -1,89 +1,318 @@
+import asyncio
 import os
-import signal
-import subprocess
-import threading
+import shutil
+import time
+import urllib.parse
+from typing import Dict, List, Optional
 
-from settings import DOWNLOAD_DIR
+import admission
+import database
+import hls
+import host_health
+import metrics
+import supervisor
+from cancellation import CancelToken
+from models import DownloadProgress, DownloadReport, EpisodeResult
+from probe import Source
+from settings import (DOWNLOAD_DIR, DOWNLOAD_CONCURRENCY, DOWNLOAD_HOST_CONCURRENCY, DOWNLOAD_BACKEND, HLS_QUALITY,
+                      WORKER_PROCESSES, EMBEDDED_WORKERS)
 from logger import get_logger
 
 logger = get_logger(__name__)
 
-running_processes = []
-process_lock = threading.Lock()
-stop_flag = threading.Event()
+# Tokens of the titles being grabbed (by internal_id) and of their running episodes (by download job id).
+title_tokens: Dict[int, CancelToken] = {}
+job_tokens: Dict[int, CancelToken] = {}
 
+# The slots are per process, so worker processes split the limits between them.
+slot_count = max(DOWNLOAD_CONCURRENCY // WORKER_PROCESSES, 1)
+host_slot_count = max(DOWNLOAD_HOST_CONCURRENCY // WORKER_PROCESSES, 1)
 
-def is_aborted():
-    return not stop_flag.is_set()
+# Every title runs up to slot_count episode workers and they all queue here. The semaphore wakes waiters
+# in arrival order and a worker queues again after each episode, so titles take turns and one long series can't
+# starve the others, while a title grabbed alone still uses every slot.
+download_slots = asyncio.Semaphore(slot_count)
+host_slots: Dict[str, asyncio.Semaphore] = {}
 
 
-def reset():
-    stop_flag.clear()
+def open_title(internal_id: int) -> CancelToken:
+    if internal_id not in title_tokens:
+        title_tokens[internal_id] = CancelToken()
+    return title_tokens[internal_id]
 
 
-def start_subprocess(command: list) -> subprocess.Popen:
-    return subprocess.Popen(
-        command,
-        preexec_fn=os.setsid,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True
-    )
+def close_title(internal_id: int):
+    title_tokens.pop(internal_id, None)
 
 
-def download_video(url, filename) -> bool:
-    global running_processes
+def is_cancelled(internal_id: int) -> bool:
+    token = title_tokens.get(internal_id)
+    return token is not None and token.cancelled
 
+
+def cancel_title(internal_id: int, reason: str = "cancelled") -> bool:
+    token = title_tokens.get(internal_id)
+    if token is None:
+        return False
+    token.cancel(reason)
+    logger.info(f"⏹ Title {internal_id} {reason}")
+    return True
+
+
+def get_format_args() -> list:
+    # Same variant the native downloader and the probe pick, so the quality reported to Sonarr/Radarr holds.
+    if HLS_QUALITY == "worst":
+        return ["-f", "worst"]
+    if HLS_QUALITY.isdigit():
+        return ["-f", f"best[height<={HLS_QUALITY}]/worst"]
+    return []
+
+
+def observe_download(backend: str, started: float, progress: DownloadProgress):
+    metrics.download_seconds.observe(time.monotonic() - started, backend, progress.state)
+    # Only what this run received; resumes, restarts and failovers would otherwise count the same bytes again.
+    metrics.download_bytes.inc(backend, amount=max(progress.downloaded_bytes - progress.resumed_bytes, 0))
+
+
+async def download_video(job_id: int, url, filename, min_speed: Optional[int] = None) -> DownloadProgress:
     logger.info(f"🎬 Starting download: {filename}")
     output_path = os.path.join(DOWNLOAD_DIR, filename)
 
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-    command = [
-        "yt-dlp",
-        "--quiet",
-        "--no-progress",
-        "-o", output_path,
-        url
-    ]
-
-    try:
-        process = start_subprocess(command)
-        with process_lock:
-            running_processes.append(process)
-        for line in process.stdout:
-            logger.info(f"[yt-dlp] {line.strip()}")
+    native = None
+    if DOWNLOAD_BACKEND == "auto":
+        started = time.monotonic()
+        native = await hls.download(job_id, url, filename, output_path, min_speed)
+        observe_download("hls", started, native)
+        if native.state == "finished":
+            logger.info(f"✅ Finished downloading: {output_path}")
+            return native
+        if native.state == "failed":
+            return native
+        logger.info(f"[HLS] Falling back to yt-dlp for {filename}: {native.error}")
+
+    def build_command(rate_limit: Optional[int]) -> list:
+        return [
+            "yt-dlp",
+            "--quiet",
+            *supervisor.PROGRESS_ARGS,
+            "--continue",
+            *get_format_args(),
+            *(["--limit-rate", str(rate_limit)] if rate_limit else []),
+            "-o", output_path,
+            url
+        ]
+
+    started = time.monotonic()
+    progress = await supervisor.run(job_id, filename, build_command, min_speed)
+    observe_download("yt-dlp", started, progress)
+    if progress.state == "finished":
+        # A native attempt that failed halfway leaves its segments for a later resume; yt-dlp made them useless.
+        shutil.rmtree(output_path + ".hls", ignore_errors=True)
         logger.info(f"✅ Finished downloading: {output_path}")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Download failed for {url}: {e}")
-        return False
-    finally:
-        with process_lock:
-            if process in running_processes:
-                running_processes.remove(process)
+    else:
+        logger.error(f"❌ Download failed for {output_path}: {progress.error}")
+        if native is not None and not progress.host_error:
+            # The host already failed the native attempt, whatever went wrong with yt-dlp after it.
+            progress.host_error = native.host_error
+    return progress
+
+
+def stop_all_downloads() -> int:
+    # Stopped work is not counted as an attempt and resumes on the next run.
+    titles = list(title_tokens)
+    for internal_id in titles:
+        cancel_title(internal_id, "stopped")
+    return len(titles)
+
+
+async def pause_job(job_id: int) -> Optional[str]:
+    """
+    The job's new state, "pausing" while a worker process has yet to stop it, or None when it can't be paused.
+    """
+    if job_id in job_tokens:
+        job_tokens[job_id].cancel("paused")
+        return "paused"
+    if await database.set_download_job_state(job_id, "paused", ("pending", "failed")):
+        return "paused"
+    return await request_job_state(job_id, "paused")
+
+
+async def resume_job(job_id: int) -> bool:
+    # Claimed by the running grab of its title, or by the next recovery sweep.
+    return await database.set_download_job_state(job_id, "pending", ("paused",))
+
+
+async def cancel_job(job_id: int) -> Optional[str]:
+    if job_id in job_tokens:
+        job_tokens[job_id].cancel("cancelled")
+        return "cancelled"
+    if await database.set_download_job_state(job_id, "cancelled", ("pending", "failed", "paused")):
+        return "cancelled"
+    return await request_job_state(job_id, "cancelled")
+
+
+async def request_job_state(job_id: int, state: str) -> Optional[str]:
+    # A job running in a worker process is stopped there, at the worker's next lease renewal.
+    if EMBEDDED_WORKERS or not await database.request_download_job_state(job_id, state):
+        return None
+    return {"paused": "pausing", "cancelled": "cancelling"}[state]
+
 
+async def apply_requested_states():
+    requested = await database.get_requested_job_states(list(job_tokens)) if job_tokens else {}
+    for job_id, state in requested.items():
+        token = job_tokens.get(job_id)
+        if token is not None and not token.cancelled:
+            logger.info(f"⏹ Job {job_id} {state} through the API")
+            token.cancel(state)
 
-def stop_all_downloads():
-    for proc in running_processes:
-        if proc.poll() is None:
-            try:
-                os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-                stop_flag.set()
-            except Exception as e:
-                print(f"Failed to kill {proc.pid}: {e}")
 
+def get_host_slot(url: str) -> asyncio.Semaphore:
+    host = urllib.parse.urlparse(url).hostname or ""
+    if host not in host_slots:
+        host_slots[host] = asyncio.Semaphore(host_slot_count)
+    return host_slots[host]
 
-def download_videos(film_name: str, video_urls: list, season: int = None):
-    video_urls = list(filter(None, video_urls))
+
+def get_file_size(filename: str):
+    output_path = os.path.join(DOWNLOAD_DIR, filename)
+    for path in (output_path, output_path + ".part", os.path.join(output_path + ".hls", "combined.ts")):
+        if os.path.exists(path):
+            return os.path.getsize(path)
+    return None
+
+
+def discard_partial(filename: str):
+    output_path = os.path.join(DOWNLOAD_DIR, filename)
+    if os.path.exists(output_path + ".part"):
+        os.remove(output_path + ".part")
+    shutil.rmtree(output_path + ".hls", ignore_errors=True)
+
+
+def get_candidates(source: Source) -> List[Source]:
+    # Unhealthy hosts go last; otherwise the ranking from the scrape stands.
+    return sorted([source, *source.alternatives], key=lambda candidate: host_health.is_unhealthy(candidate.url))
+
+
+async def download_episode(job_id: int, source: Source, filename: str, episode: int = None,
+                           estimate: int = 0) -> EpisodeResult:
+    candidates = get_candidates(source)
+    # The job's source is where the partial file came from.
+    current = source.url
+    # The global slot is shared by every title, so parallel seasons can't exceed slot_count.
+    async with download_slots:
+        # Waiting here holds the slot, so a full disk pauses the whole queue instead of failing downloads.
+        await admission.wait_for_space(filename, estimate, supervisor.get_progress)
+        for number, candidate in enumerate(candidates):
+            if candidate.url != current:
+                # Another mirror may encode differently, so its bytes can't continue this partial file.
+                logger.info(f"[Failover] {filename}: switching to {candidate.url} ({number + 1}/{len(candidates)})")
+                metrics.download_failovers.inc()
+                discard_partial(filename)
+                current = candidate.url
+                await database.set_download_job_source(job_id, candidate.url, candidate.height,
+                                                       [(other.url, other.height) for other in candidates
+                                                        if other is not candidate])
+            # The last mirror is kept however slow it is.
+            min_speed = admission.min_speed if number < len(candidates) - 1 else None
+            async with get_host_slot(candidate.url):
+                progress = await download_video(job_id, candidate.url, filename, min_speed)
+            if progress.state == "finished":
+                host_health.record_success(candidate.url)
+                break
+            # Our own failures (no yt-dlp, a full disk, DOWNLOAD_TIMEOUT) say nothing about the host.
+            if progress.host_error:
+                logger.info(f"[Health] {candidate.url} failed: {progress.host_error}")
+                host_health.record_failure(candidate.url)
+    return EpisodeResult(episode=episode, filename=filename, success=progress.state == "finished",
+                         error=progress.error, height=candidate.height)
+
+
+async def finish_job(job_id: int, filename: str, result: EpisodeResult, reason: Optional[str]):
+    if result.success or reason is None:
+        await database.finish_download_job(job_id, result.success, get_file_size(filename), result.error)
+    elif reason == "lost":
+        # The title's new holder requeued this job when it took over.
+        return
+    elif reason == "cancelled":
+        await database.set_download_job_state(job_id, "cancelled", ("running",))
+    else:
+        # Paused or stopped: keep the partial file, yt-dlp --continue resumes it.
+        await database.release_download_job(job_id, "paused" if reason == "paused" else "pending")
+
+
+async def run_download_jobs(title: CancelToken, internal_id: int, season: int = None) -> list:
+    results = []
+    while not title.cancelled:
+        job = await database.claim_download_job(internal_id, season)
+        if job is None:
+            break
+        job_id, url, filename, episode, height, alternatives = job
+        # Episodes of a title are about the same size; a partial file only needs the rest.
+        expected = await database.get_average_job_size(internal_id) or admission.size_estimate
+        estimate = max(expected - (get_file_size(filename) or 0), 0)
+
+        token = CancelToken(title)
+        source = Source(url=url, height=height,
+                        alternatives=tuple(Source(url=other, height=other_height) for other, other_height in alternatives))
+        token.task = asyncio.create_task(download_episode(job_id, source, filename, episode, estimate))
+        job_tokens[job_id] = token
+        try:
+            result = await token.task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            logger.info(f"⏹ Download {token.reason}: {filename}")
+            result = EpisodeResult(episode=episode, filename=filename, success=False, error=token.reason)
+        finally:
+            job_tokens.pop(job_id, None)
+            token.close()
+
+        await finish_job(job_id, filename, result, token.reason)
+        results.append(result)
+    return results
+
+
+async def download_videos(internal_id: int, film_name: str, sources: List[Optional[Source]], season: int = None,
+                          episode_numbers: list = None) -> DownloadReport:
     safe_film_name = film_name.replace(" ", "_")
     download_folder = f"{safe_film_name}/"
-    for index, url in enumerate(video_urls, start=1):
-        if is_aborted():
-            season_part = f"_S{int(season):02d}" if season else ""
-            episode_part = f"_E{index:02d}" if season else ""
-            filename = download_folder + f"{safe_film_name}{season_part}{episode_part}.mp4"
-            download_video(url, filename)
-
-    reset()
-    return download_folder
+    report = DownloadReport(folder=download_folder)
+
+    episodes = []
+    # Episode numbers default to the position in sources; a planned subset passes its own.
+    for index, source in zip(episode_numbers or range(1, len(sources) + 1), sources):
+        if not source:
+            logger.info(f"No source for {film_name} episode {index}, skipping.")
+            continue
+        season_part = f"_S{int(season):02d}" if season else ""
+        episode_part = f"_E{index:02d}" if season else ""
+        filename = download_folder + f"{safe_film_name}{season_part}{episode_part}.mp4"
+        alternatives = [(alternative.url, alternative.height) for alternative in source.alternatives]
+        episodes.append((index if season else None, source.url, filename, source.height, alternatives))
+
+    # Jobs already done in an earlier run stay done; only pending and due failed episodes are claimed.
+    title = open_title(internal_id)
+    if title.cancelled:
+        return report
+    await database.enqueue_download_jobs(internal_id, season, episodes)
+    if episodes:
+        workers = min(slot_count, len(episodes))
+        batches = await asyncio.gather(*(run_download_jobs(title, internal_id, season) for _ in range(workers)))
+        report.results = [result for batch in batches for result in batch]
+
+    # Episodes finished by an earlier run are imported too, in case that run's import never happened or failed.
+    # Sonarr/Radarr move imported files away, so only the ones still on disk count.
+    claimed = {result.filename for result in report.results}
+    for episode, filename, height in await database.get_done_jobs(internal_id, season):
+        if filename not in claimed and os.path.exists(os.path.join(DOWNLOAD_DIR, filename)):
+            report.results.append(EpisodeResult(episode=episode, filename=filename, success=True, height=height))
+    report.results.sort(key=lambda result: result.filename)
+
+    for result in report.failed:
+        logger.error(f"❌ Episode failed: {result.filename}")
+    logger.info(f"[Download] {film_name}: {len(report.succeeded)} succeeded, {len(report.failed)} failed")
+
+    return report
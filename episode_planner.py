@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import http_clients
+import sonarr_snapshot
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+async def get_json(url: str, params: dict):
+    response = await http_clients.request("sonarr", "GET", url, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def has_aired(episode: dict, now: datetime) -> bool:
+    air_date = episode.get("airDateUtc")
+    if not air_date:
+        return False
+    return datetime.fromisoformat(air_date.replace("Z", "+00:00")) <= now
+
+
+async def plan_series(series_id: int) -> Dict[int, List[int]]:
+    """
+    Returns the monitored, aired episodes Sonarr has no file for, as season -> episode numbers.
+    """
+    seasons = set(await sonarr_snapshot.get_missing_seasons(series_id))
+    if not seasons:
+        return {}
+
+    # One call per endpoint for the whole series, sent together over the pooled Sonarr client.
+    episodes, episode_files = await asyncio.gather(
+        get_json("/api/v3/episode", {"seriesId": series_id}),
+        get_json("/api/v3/episodefile", {"seriesId": series_id}),
+    )
+    file_ids = {episode_file["id"] for episode_file in episode_files}
+    now = datetime.now(timezone.utc)
+
+    plan: Dict[int, List[int]] = {}
+    for episode in episodes:
+        season = episode.get("seasonNumber")
+        number = episode.get("episodeNumber")
+        if season not in seasons or not number or not episode.get("monitored", True):
+            continue
+        if episode.get("hasFile") and episode.get("episodeFileId") in file_ids:
+            continue
+        if not has_aired(episode, now):
+            continue
+        plan.setdefault(season, []).append(number)
+
+    for numbers in plan.values():
+        numbers.sort()
+    logger.info(f"[Planner] Series {series_id} is missing {sum(map(len, plan.values()))} episodes: {plan}")
+    return dict(sorted(plan.items()))
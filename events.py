@@ -0,0 +1,166 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+
+from ingest import ADD_EVENTS, DELETE_EVENTS
+from models import MediaData
+from settings import JSON_DECODER
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+# Only the fields the service reads. Everything else in a webhook (episodes, files, release, custom formats)
+# is skipped by the decoder instead of being built into dicts and thrown away.
+if msgspec is not None:
+    class Title(msgspec.Struct, rename="camel"):
+        id: Optional[int] = None
+        title: Optional[str] = None
+        tmdb_id: Optional[int] = None
+        imdb_id: Optional[str] = None
+        tvdb_id: Optional[int] = None
+
+    class Event(msgspec.Struct, rename="camel"):
+        event_type: Optional[str] = None
+        # Sonarr sends the series, Radarr the movie.
+        series: Optional[Title] = None
+        movie: Optional[Title] = None
+else:
+    @dataclass(slots=True)
+    class Title:
+        id: Optional[int] = None
+        title: Optional[str] = None
+        tmdb_id: Optional[int] = None
+        imdb_id: Optional[str] = None
+        tvdb_id: Optional[int] = None
+
+    @dataclass(slots=True)
+    class Event:
+        event_type: Optional[str] = None
+        series: Optional[Title] = None
+        movie: Optional[Title] = None
+
+
+def get_field(data: dict, key: str, kind: type, path: str = "$"):
+    value = data.get(key)
+    # type() rather than isinstance(), so true is not taken for an id.
+    if value is None or type(value) is kind:
+        return value
+    raise InvalidEvent(f"Expected `{kind.__name__} | null`, got `{type(value).__name__}` - at `{path}.{key}`")
+
+
+def build_title(data, path: str) -> Optional[Title]:
+    if data is None:
+        return None
+    if not isinstance(data, dict):
+        raise InvalidEvent(f"Expected `object | null`, got `{type(data).__name__}` - at `{path}`")
+    return Title(id=get_field(data, "id", int, path), title=get_field(data, "title", str, path),
+                 tmdb_id=get_field(data, "tmdbId", int, path), imdb_id=get_field(data, "imdbId", str, path),
+                 tvdb_id=get_field(data, "tvdbId", int, path))
+
+
+def build_event(data) -> Event:
+    if not isinstance(data, dict):
+        raise InvalidEvent(f"Expected `object`, got `{type(data).__name__}`")
+    return Event(event_type=get_field(data, "eventType", str), series=build_title(data.get("series"), "$.series"),
+                 movie=build_title(data.get("movie"), "$.movie"))
+
+
+def decode_json(body: bytes) -> Event:
+    try:
+        data = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise InvalidEvent(str(e))
+    return build_event(data)
+
+
+def decode_orjson(body: bytes) -> Event:
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise InvalidEvent(str(e))
+    return build_event(data)
+
+
+def decode_msgspec(body: bytes) -> Event:
+    try:
+        return event_decoder.decode(body)
+    except msgspec.DecodeError as e:
+        raise InvalidEvent(str(e))
+
+
+DECODERS: Dict[str, Callable[[bytes], Event]] = {"json": decode_json}
+
+if orjson is not None:
+    DECODERS["orjson"] = decode_orjson
+
+if msgspec is not None:
+    event_decoder = msgspec.json.Decoder(Event)
+    DECODERS["msgspec"] = decode_msgspec
+
+
+def get_decoder_name() -> str:
+    if JSON_DECODER != "auto":
+        if JSON_DECODER in DECODERS:
+            return JSON_DECODER
+        logger.info(f"[Webhook] Decoder {JSON_DECODER} is not installed, falling back")
+    for name in ("msgspec", "orjson", "json"):
+        if name in DECODERS:
+            return name
+
+
+decoder_name = get_decoder_name()
+decode = DECODERS[decoder_name]
+
+
+def to_media_data(event: Event, source_type: str) -> Optional[MediaData]:
+    """
+    None for an event about no title (Health, HealthRestored, ApplicationUpdate, ...), which is ignored.
+    """
+    title = event.series if source_type == "SONARR" else event.movie
+    if title is None:
+        if event.event_type in ADD_EVENTS + DELETE_EVENTS:
+            raise InvalidEvent(f"{event.event_type} event without a {'series' if source_type == 'SONARR' else 'movie'}")
+        return None
+    return MediaData(
+        internal_id=title.id,
+        created_on=str(datetime.now()),
+        source_type=source_type,
+        event_type=event.event_type,
+        imdb_id=title.imdb_id,
+        series_title=title.title,
+        tmdb_id=title.tmdb_id,
+        tvdb_id=title.tvdb_id,
+        local_title=None
+    )
+
+
+async def read_media_data(request: Request, source_type: str) -> Optional[MediaData]:
+    body = await request.body()
+    try:
+        event = decode(body)
+        media_data = to_media_data(event, source_type)
+    except (InvalidEvent, ValidationError) as e:
+        logger.info(f"[Webhook] Rejected {source_type} body: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid webhook body: {e}")
+    if media_data is None:
+        logger.info(f"[Webhook] Ignored {source_type} {event.event_type} event")
+    return media_data
@@ -0,0 +1,392 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+import time
+import urllib.parse
+from typing import List, NamedTuple, Optional, Tuple
+
+import httpx
+
+import host_health
+import http_clients
+import metrics
+import supervisor
+from models import DownloadProgress
+from settings import (HLS_QUALITY, HLS_SEGMENT_CONCURRENCY, HLS_HEDGE_AFTER, HTTP_RETRIES, HTTP_RETRY_BACKOFF,
+                      DOWNLOAD_TIMEOUT, DOWNLOAD_SLOW_WINDOW)
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+ATTRIBUTE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+# Player pages embed the playlist url in their script instead of serving it directly.
+PLAYLIST_URL = re.compile(r'https?://[^\s"\'<>]+?\.m3u8[^\s"\'<>]*')
+CHUNK_SIZE = 64 * 1024
+
+
+class Unsupported(Exception):
+    """
+    The stream is not something the native downloader handles; yt-dlp gets it instead.
+    """
+
+
+class Variant(NamedTuple):
+    url: str
+    bandwidth: int
+    height: int
+    width: int
+
+
+class Segment(NamedTuple):
+    url: str
+    duration: float
+
+
+def parse_attributes(value: str) -> dict:
+    return {key: item.strip('"') for key, item in ATTRIBUTE.findall(value)}
+
+
+def parse_master(text: str, base_url: str) -> List[Variant]:
+    variants = []
+    attributes = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            attributes = parse_attributes(line.split(":", 1)[1])
+        elif line and not line.startswith("#") and attributes is not None:
+            width, _, height = attributes.get("RESOLUTION", "0x0").partition("x")
+            variants.append(Variant(
+                url=urllib.parse.urljoin(base_url, line),
+                bandwidth=int(attributes.get("BANDWIDTH") or 0),
+                height=int(height or 0),
+                width=int(width or 0)
+            ))
+            attributes = None
+    return variants
+
+
+def parse_media(text: str, base_url: str) -> List[Segment]:
+    segments = []
+    duration = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-KEY:") and parse_attributes(line.split(":", 1)[1]).get("METHOD") != "NONE":
+            raise Unsupported("encrypted playlist")
+        if line.startswith(("#EXT-X-BYTERANGE", "#EXT-X-MAP")):
+            raise Unsupported(f"unsupported tag {line.split(':', 1)[0]}")
+        if line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0] or 0)
+        elif line and not line.startswith("#"):
+            segments.append(Segment(url=urllib.parse.urljoin(base_url, line), duration=duration or 0))
+            duration = None
+    if "#EXT-X-ENDLIST" not in text:
+        raise Unsupported("live playlist")
+    return segments
+
+
+def choose_variant(variants: List[Variant], policy: str = HLS_QUALITY) -> Variant:
+    """
+    "best", "worst", or a maximum height such as "720" (the best variant not above it, else the smallest).
+    """
+    ranked = sorted(variants, key=lambda variant: (variant.height, variant.bandwidth))
+    if policy == "worst":
+        return ranked[0]
+    if policy.isdigit():
+        fitting = [variant for variant in ranked if variant.height <= int(policy)]
+        return fitting[-1] if fitting else ranked[0]
+    return ranked[-1]
+
+
+async def get_text(url: str) -> Tuple[str, str]:
+    response = await http_clients.request("hls", "GET", url)
+    response.raise_for_status()
+    return response.text, str(response.url)
+
+
+async def resolve_playlist(url: str) -> Tuple[Optional[Variant], List[Segment]]:
+    text, url = await get_text(url)
+    if not text.lstrip().startswith("#EXTM3U"):
+        match = PLAYLIST_URL.search(text)
+        if not match:
+            raise Unsupported("not an HLS stream")
+        text, url = await get_text(match.group(0).replace("\\/", "/"))
+
+    variant = None
+    if "#EXT-X-STREAM-INF" in text:
+        variants = parse_master(text, url)
+        if not variants:
+            raise Unsupported("master playlist without variants")
+        variant = choose_variant(variants)
+        text, url = await get_text(variant.url)
+    return variant, parse_media(text, url)
+
+
+class Pacer:
+    """
+    Keeps one job under its share of the bandwidth budget; the share is re-read as other jobs come and go.
+    """
+
+    def __init__(self, progress: DownloadProgress):
+        self.progress = progress
+        self.rate = None
+        self.started = time.monotonic()
+        self.sent = 0
+
+    async def consume(self, size: int):
+        rate = supervisor.get_rate_limit()
+        if rate != self.rate:
+            self.rate, self.started, self.sent = rate, time.monotonic(), 0
+            self.progress.rate_limit = rate
+        self.sent += size
+        if rate:
+            ahead = self.sent / rate - (time.monotonic() - self.started)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+
+def record(progress: DownloadProgress, size: int, window: dict):
+    progress.downloaded_bytes += size
+    supervisor.totals["bytes"] += size
+    now = time.monotonic()
+    if now - window["started"] >= 1:
+        progress.speed = (progress.downloaded_bytes - window["bytes"]) / (now - window["started"])
+        window["started"], window["bytes"] = now, progress.downloaded_bytes
+    progress.updated_on = time.time()
+    progress.average_speed = progress.downloaded_bytes / max(progress.updated_on - progress.started_on, 1)
+
+
+async def stream_segment(url: str, path: str, progress: DownloadProgress, pacer: Pacer, window: dict,
+                         activity: dict):
+    client = http_clients.get_client("hls")
+    started = time.monotonic()
+    received = 0
+    complete = False
+    try:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            host_health.record_success(url, time.monotonic() - started)
+            with open(path, "wb") as f:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    f.write(chunk)
+                    received += len(chunk)
+                    activity["last"] = time.monotonic()
+                    record(progress, len(chunk), window)
+                    await pacer.consume(len(chunk))
+        complete = True
+    except (httpx.TransportError, httpx.HTTPStatusError):
+        host_health.record_failure(url)
+        raise
+    finally:
+        # Bytes of a failed or abandoned request are fetched again, so they don't count as progress.
+        if not complete:
+            progress.downloaded_bytes -= received
+
+
+async def fetch_hedged(segment: Segment, path: str, progress: DownloadProgress, pacer: Pacer, window: dict,
+                       speed: supervisor.SpeedWatch):
+    """
+    Fetches one segment; when no byte arrived for HLS_HEDGE_AFTER seconds a duplicate request races the first
+    one and whichever finishes first is kept.
+    """
+    activity = {"last": time.monotonic()}
+    tasks = {}
+
+    def start(part: str):
+        tasks[asyncio.create_task(stream_segment(segment.url, part, progress, pacer, window, activity))] = part
+
+    start(path + ".0")
+    hedged = not HLS_HEDGE_AFTER
+    try:
+        while True:
+            done, _ = await asyncio.wait(tasks, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                part = tasks.pop(task)
+                if task.exception() is None:
+                    os.replace(part, path)
+                    return
+                if not tasks:
+                    raise task.exception()
+            if speed.is_slow():
+                raise supervisor.TooSlow(f"under {speed.min_speed} B/s for the last {DOWNLOAD_SLOW_WINDOW}s")
+            if not hedged and time.monotonic() - activity["last"] >= HLS_HEDGE_AFTER:
+                hedged = True
+                http_clients.stats["hls"]["requests"] += 1
+                metrics.hls_hedged.inc()
+                logger.info(f"[HLS] Segment {segment.url} stalled, sending a hedged request")
+                start(path + ".1")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for part in tasks.values():
+            if os.path.exists(part):
+                os.remove(part)
+
+
+async def fetch_segment(segment: Segment, path: str, progress: DownloadProgress, pacer: Pacer, window: dict,
+                        speed: supervisor.SpeedWatch):
+    stats = http_clients.stats["hls"]
+    for attempt in range(HTTP_RETRIES + 1):
+        stats["requests"] += 1
+        try:
+            await fetch_hedged(segment, path, progress, pacer, window, speed)
+            return
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            response = getattr(e, "response", None)
+            error = None if response is not None else e
+            if attempt >= HTTP_RETRIES or not http_clients.should_retry("GET", response, error):
+                stats["errors"] += 1
+                raise
+            stats["retries"] += 1
+            logger.info(f"[HLS] Segment {segment.url} failed ({e}), retry {attempt + 1}/{HTTP_RETRIES}")
+            await asyncio.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt)
+
+
+def append(target, path: str) -> int:
+    # sendfile copies between the two files inside the kernel, without reading the segment into Python.
+    size = os.path.getsize(path)
+    with open(path, "rb") as source:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(target.fileno(), source.fileno(), offset, size - offset)
+            if not sent:
+                break
+            offset += sent
+    target.flush()
+    return size
+
+
+def get_playlist_key(segments: List[Segment]) -> str:
+    # Segment urls carry per-session tokens, so only their paths identify the same stream on a later run.
+    first, last = (urllib.parse.urlsplit(segment.url).path for segment in (segments[0], segments[-1]))
+    return f"{first}|{last}|{len(segments)}"
+
+
+def load_state(workdir: str, playlist: str, count: int) -> dict:
+    try:
+        with open(os.path.join(workdir, "state.json")) as f:
+            state = json.load(f)
+        if state["playlist"] == playlist and state["segments"] == count:
+            return state
+    except (OSError, ValueError, KeyError):
+        pass
+    return {"playlist": playlist, "segments": count, "appended": 0, "size": 0}
+
+
+def save_state(workdir: str, state: dict):
+    path = os.path.join(workdir, "state.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+async def fetch_all(segments: List[Segment], workdir: str, progress: DownloadProgress, state: dict,
+                    speed: supervisor.SpeedWatch):
+    combined_path = os.path.join(workdir, "combined.ts")
+    pacer = Pacer(progress)
+    window = {"started": time.monotonic(), "bytes": progress.downloaded_bytes}
+    slots = asyncio.Semaphore(HLS_SEGMENT_CONCURRENCY)
+    tasks = {}
+    upcoming = state["appended"]
+
+    async def fetch(index: int) -> str:
+        path = os.path.join(workdir, f"segment-{index:06d}.ts")
+        async with slots:
+            await fetch_segment(segments[index], path, progress, pacer, window, speed)
+        return path
+
+    # Segments are fetched a bounded window ahead and appended strictly in playlist order.
+    # Anything past the last recorded append is a torn write from an interrupted run.
+    with open(combined_path, "r+b" if os.path.exists(combined_path) else "wb") as combined:
+        combined.truncate(state["size"])
+        combined.seek(state["size"])
+        try:
+            for index in range(state["appended"], len(segments)):
+                while upcoming < len(segments) and len(tasks) < HLS_SEGMENT_CONCURRENCY * 2:
+                    tasks[upcoming] = asyncio.create_task(fetch(upcoming))
+                    upcoming += 1
+                path = await tasks.pop(index)
+                state["size"] += append(combined, path)
+                state["appended"] = index + 1
+                os.remove(path)
+                save_state(workdir, state)
+
+                done = index + 1
+                progress.total_bytes = int(state["size"] / done * len(segments))
+                if progress.speed:
+                    progress.eta = int((progress.total_bytes - state["size"]) / progress.speed)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            # Wait for the cancelled fetches to let go of their files and connections before the caller moves on.
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return combined_path
+
+
+async def remux(source: str, output_path: str):
+    temporary = output_path + ".remux.mp4"
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y", "-loglevel", "error", "-i", source, "-c", "copy", "-bsf:a", "aac_adtstoasc",
+        "-movflags", "+faststart", temporary,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT
+    )
+    try:
+        output, _ = await process.communicate()
+    finally:
+        if process.returncode is None:
+            process.kill()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {output.decode(errors='replace').strip()}")
+    os.replace(temporary, output_path)
+
+
+async def fetch_stream(url: str, output_path: str, progress: DownloadProgress, speed: supervisor.SpeedWatch):
+    variant, segments = await resolve_playlist(url)
+    if not segments:
+        raise Unsupported("empty playlist")
+    if variant:
+        logger.info(f"[HLS] {progress.filename}: {variant.width}x{variant.height} at {variant.bandwidth} b/s, "
+                    f"{len(segments)} segments")
+
+    workdir = output_path + ".hls"
+    os.makedirs(workdir, exist_ok=True)
+    state = load_state(workdir, get_playlist_key(segments), len(segments))
+    progress.downloaded_bytes = progress.resumed_bytes = state["size"]
+    if variant and variant.bandwidth:
+        progress.total_bytes = int(variant.bandwidth / 8 * sum(segment.duration for segment in segments))
+
+    combined_path = await fetch_all(segments, workdir, progress, state, speed)
+    await remux(combined_path, output_path)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def download(job_id: int, url: str, filename: str, output_path: str,
+                   min_speed: Optional[int] = None) -> DownloadProgress:
+    """
+    Downloads an HLS stream natively; state is "fallback" when yt-dlp should try instead.
+    """
+    progress = supervisor.track(job_id, filename)
+    try:
+        await asyncio.wait_for(fetch_stream(url, output_path, progress, supervisor.SpeedWatch(progress, min_speed)),
+                               DOWNLOAD_TIMEOUT)
+        progress.state = "finished"
+    except asyncio.TimeoutError:
+        # The time limit covers the whole episode, so yt-dlp does not get another DOWNLOAD_TIMEOUT after this.
+        logger.error(f"[HLS] {filename} timed out after {DOWNLOAD_TIMEOUT}s")
+        progress.state, progress.error = "failed", "timeout"
+    except supervisor.TooSlow as e:
+        logger.error(f"[HLS] {filename} too slow: {e}")
+        progress.state, progress.error, progress.host_error = "failed", "slow", "slow"
+    except Unsupported as e:
+        progress.state, progress.error = "fallback", str(e)
+    except Exception as e:
+        logger.error(f"[HLS] {filename} failed: {e!r}")
+        progress.state, progress.error = "fallback", repr(e)
+        if host_health.is_host_error(e):
+            progress.host_error = repr(e)
+    finally:
+        supervisor.untrack(progress)
+    return progress
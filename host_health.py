@@ -0,0 +1,98 @@
+import time
+import urllib.parse
+from typing import Dict, Optional
+
+import httpx
+
+import database
+from settings import HOST_MAX_ERROR_RATE
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Weight of the newest request in the moving averages.
+ALPHA = 0.2
+# A host's error rate says little before this many requests.
+MIN_SAMPLES = 3
+# Assumed time to first byte of a host nothing was fetched from yet.
+DEFAULT_LATENCY = 1.0
+
+# Latency EWMA and error rate EWMA by host, kept across restarts in the host_health table.
+hosts: Dict[str, dict] = {}
+changed: set = set()
+
+
+def get_host(url: str) -> str:
+    return urllib.parse.urlsplit(url).hostname or ""
+
+
+def get_entry(url: str) -> dict:
+    host = get_host(url)
+    if host not in hosts:
+        hosts[host] = {"latency": None, "error_rate": 0.0, "samples": 0, "updated_on": 0.0}
+    return hosts[host]
+
+
+def update(url: str, error: bool, latency: Optional[float] = None):
+    entry = get_entry(url)
+    # The first request sets the averages; later ones move them by ALPHA.
+    weight = ALPHA if entry["samples"] else 1
+    entry["error_rate"] += weight * (error - entry["error_rate"])
+    if latency is not None:
+        entry["latency"] = latency if entry["latency"] is None else entry["latency"] + ALPHA * (latency - entry["latency"])
+    entry["samples"] += 1
+    entry["updated_on"] = time.time()
+    changed.add(get_host(url))
+
+
+def record_success(url: str, latency: Optional[float] = None):
+    update(url, False, latency)
+
+
+def record_failure(url: str):
+    update(url, True)
+
+
+def is_host_error(e: BaseException) -> bool:
+    # Only what the host answered or how its connection broke counts, not a busy local pool.
+    return isinstance(e, (httpx.HTTPStatusError, httpx.TransportError)) and not isinstance(e, httpx.PoolTimeout)
+
+
+def is_failing(entry: dict) -> bool:
+    return entry["samples"] >= MIN_SAMPLES and entry["error_rate"] > HOST_MAX_ERROR_RATE
+
+
+def is_unhealthy(url: str) -> bool:
+    entry = hosts.get(get_host(url))
+    return entry is not None and is_failing(entry)
+
+
+def get_score(url: str, latency: Optional[float] = None) -> float:
+    """
+    Expected seconds to a good first byte: the latency, or the host's average, stretched by its error rate.
+    """
+    entry = hosts.get(get_host(url))
+    if latency is None:
+        latency = entry["latency"] if entry and entry["latency"] is not None else DEFAULT_LATENCY
+    error_rate = entry["error_rate"] if entry else 0.0
+    return latency / max(1 - error_rate, 0.1)
+
+
+async def load():
+    for host, latency, error_rate, samples, updated_on in await database.get_host_health():
+        hosts[host] = {"latency": latency, "error_rate": error_rate, "samples": samples, "updated_on": updated_on}
+    if hosts:
+        logger.info(f"[Health] Loaded {len(hosts)} hosts")
+
+
+async def save():
+    if not changed:
+        return
+    rows = [(host, hosts[host]["latency"], hosts[host]["error_rate"], hosts[host]["samples"],
+             hosts[host]["updated_on"]) for host in changed]
+    changed.clear()
+    await database.save_host_health(rows)
+
+
+def get_health() -> Dict[str, dict]:
+    return {host: {**entry, "unhealthy": is_failing(entry)} for host, entry in sorted(hosts.items())}
@@ -0,0 +1,138 @@
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from settings import HTML_PARSER
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class Query(NamedTuple):
+    css: str
+    xpath: str
+    # Lets html.parser build only the subtree the query can match instead of the whole page.
+    strainer: SoupStrainer
+    attr: Optional[str] = None
+
+
+SEARCH_LINK = Query(
+    css="div#block-search-page div.row div.col div.item a[href]",
+    xpath=f"//div[@id='block-search-page']//div[{has_class('row')}]//div[{has_class('col')}]"
+          f"//div[{has_class('item')}]//a[@href]",
+    strainer=SoupStrainer("div", id="block-search-page"),
+    attr="href"
+)
+LD_JSON = Query(
+    css='script[type="application/ld+json"]',
+    xpath="//script[@type='application/ld+json']",
+    strainer=SoupStrainer("script", type="application/ld+json")
+)
+SERIES_OPTIONS = Query(
+    css="select#select-series option[data-series-number]",
+    xpath="//select[@id='select-series']//option[@data-series-number]",
+    strainer=SoupStrainer("select", id="select-series"),
+    attr="value"
+)
+EMBED_IFRAME = Query(
+    css="div.video-holder iframe#embed",
+    xpath=f"//div[{has_class('video-holder')}]//iframe[@id='embed']",
+    strainer=SoupStrainer("div", class_="video-holder"),
+    attr="src"
+)
+LINK_OPTIONS = Query(
+    css='option[data-type="link"]',
+    xpath="//option[@data-type='link']",
+    strainer=SoupStrainer("option", attrs={"data-type": "link"}),
+    attr="value"
+)
+
+
+def select_html_parser(html: str, query: Query, limit: int) -> List[str]:
+    soup = BeautifulSoup(html, "html.parser", parse_only=query.strainer)
+    nodes = soup.select(query.css, limit=limit)
+    if query.attr:
+        return [node.get(query.attr) for node in nodes if node.get(query.attr) is not None]
+    return [node.get_text() for node in nodes]
+
+
+def select_lxml(html: str, query: Query, limit: int) -> List[str]:
+    nodes = lxml_html.fromstring(html).xpath(query.xpath)
+    if limit:
+        nodes = nodes[:limit]
+    if query.attr:
+        return [node.get(query.attr) for node in nodes if node.get(query.attr) is not None]
+    return [node.text_content() for node in nodes]
+
+
+def select_selectolax(html: str, query: Query, limit: int) -> List[str]:
+    tree = LexborHTMLParser(html)
+    nodes = [tree.css_first(query.css)] if limit == 1 else tree.css(query.css)
+    nodes = [node for node in nodes if node is not None]
+    if limit:
+        nodes = nodes[:limit]
+    if query.attr:
+        return [node.attributes.get(query.attr) for node in nodes if node.attributes.get(query.attr) is not None]
+    return [node.text(deep=True) for node in nodes]
+
+
+BACKENDS: Dict[str, Callable[[str, Query, int], List[str]]] = {"html.parser": select_html_parser}
+
+try:
+    from lxml import html as lxml_html
+    BACKENDS["lxml"] = select_lxml
+except ImportError:
+    lxml_html = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    BACKENDS["selectolax"] = select_selectolax
+except ImportError:
+    LexborHTMLParser = None
+
+
+def get_backend_name() -> str:
+    if HTML_PARSER != "auto":
+        if HTML_PARSER in BACKENDS:
+            return HTML_PARSER
+        logger.info(f"[HTML] Parser {HTML_PARSER} is not installed, falling back")
+    for name in ("selectolax", "lxml", "html.parser"):
+        if name in BACKENDS:
+            return name
+
+
+backend_name = get_backend_name()
+backend = BACKENDS[backend_name]
+
+
+def select_all(html: str, query: Query) -> List[str]:
+    return backend(html, query, 0)
+
+
+def select_first(html: str, query: Query) -> Optional[str]:
+    values = backend(html, query, 1)
+    return values[0] if values else None
+
+
+def extract_search_link(html: str) -> Optional[str]:
+    return select_first(html, SEARCH_LINK)
+
+
+def extract_ld_json(html: str) -> Optional[str]:
+    return select_first(html, LD_JSON)
+
+
+def extract_series_options(html: str) -> List[str]:
+    return select_all(html, SERIES_OPTIONS)
+
+
+def extract_embed_src(html: str) -> Optional[str]:
+    return select_first(html, EMBED_IFRAME)
+
+
+def extract_link_options(html: str) -> List[str]:
+    return select_all(html, LINK_OPTIONS)
@@ -0,0 +1,165 @@
+import asyncio
+from typing import Dict, Optional
+
+import httpx
+
+import metrics
+from settings import (SONARR_URL, SONARR_API_KEY, RADARR_URL, RADARR_API_KEY, TMDB_BASE_URL, TMDB_API_KEY, HOST,
+                      USER_AGENT, HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_MAX_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY,
+                      HTTP2_ENABLED, HTTP_RETRIES, HTTP_RETRY_BACKOFF, SCRAPE_TIMEOUT, SCRAPE_CONCURRENCY,
+                      HLS_MAX_CONNECTIONS)
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+SERVICES = {
+    "sonarr": {
+        "base_url": SONARR_URL,
+        "headers": {"X-Api-Key": SONARR_API_KEY, "Accept": "application/json"},
+        "timeout": HTTP_TIMEOUT,
+        "max_connections": HTTP_MAX_CONNECTIONS,
+    },
+    "radarr": {
+        "base_url": RADARR_URL,
+        "headers": {"X-Api-Key": RADARR_API_KEY, "Accept": "application/json"},
+        "timeout": HTTP_TIMEOUT,
+        "max_connections": HTTP_MAX_CONNECTIONS,
+    },
+    "tmdb": {
+        "base_url": TMDB_BASE_URL,
+        "headers": {"Authorization": f"Bearer {TMDB_API_KEY}", "Accept": "application/json"},
+        "timeout": HTTP_TIMEOUT,
+        "max_connections": HTTP_MAX_CONNECTIONS,
+    },
+    "uaserial": {
+        "base_url": HOST,
+        "headers": {"User-Agent": USER_AGENT},
+        "timeout": SCRAPE_TIMEOUT,
+        "max_connections": SCRAPE_CONCURRENCY,
+    },
+    # Stream hosts; playlists and segments use absolute urls.
+    "hls": {
+        "base_url": "",
+        "headers": {"User-Agent": USER_AGENT},
+        "timeout": HTTP_TIMEOUT,
+        "max_connections": HLS_MAX_CONNECTIONS,
+    },
+}
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+clients: Dict[str, httpx.AsyncClient] = {}
+stats: Dict[str, Dict[str, int]] = {}
+
+metrics.http_requests.set_function(lambda: {(name, kind): value for name, service in stats.items()
+                                            for kind, value in service.items()})
+
+
+def new_stats() -> Dict[str, int]:
+    return {"requests": 0, "retries": 0, "errors": 0, "tcp_connects": 0, "tls_handshakes": 0}
+
+
+def create_client(name: str) -> httpx.AsyncClient:
+    config = SERVICES[name]
+    return httpx.AsyncClient(
+        base_url=config["base_url"],
+        headers=config["headers"],
+        http2=HTTP2_ENABLED,
+        follow_redirects=True,
+        timeout=httpx.Timeout(config["timeout"], connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_connections"],
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        client = clients[name] = create_client(name)
+        stats.setdefault(name, new_stats())
+    return client
+
+
+async def start_clients():
+    for name in SERVICES:
+        get_client(name)
+    logger.info(f"[HTTP] Started clients: {', '.join(SERVICES)}")
+
+
+async def close_clients():
+    for name, client in list(clients.items()):
+        await client.aclose()
+    clients.clear()
+    logger.info("[HTTP] Closed clients")
+
+
+def should_retry(method: str, response: Optional[httpx.Response], error: Optional[Exception]) -> bool:
+    # A failed connect never reached the server, so it is safe to retry any method.
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if method not in IDEMPOTENT_METHODS:
+        return False
+    if error is not None:
+        return isinstance(error, (httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.ReadError))
+    return response.status_code in RETRY_STATUS_CODES
+
+
+async def request(name: str, method: str, url: str, **kwargs) -> httpx.Response:
+    client = get_client(name)
+    service_stats = stats[name]
+    method = method.upper()
+
+    async def trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            service_stats["tcp_connects"] += 1
+        elif event_name == "connection.start_tls.complete":
+            service_stats["tls_handshakes"] += 1
+
+    extensions = {**kwargs.pop("extensions", {}), "trace": trace}
+
+    attempt = 0
+    while True:
+        service_stats["requests"] += 1
+        response, error = None, None
+        try:
+            response = await client.request(method, url, extensions=extensions, **kwargs)
+        except httpx.TransportError as e:
+            error = e
+
+        if attempt >= HTTP_RETRIES or not should_retry(method, response, error):
+            if error is not None:
+                service_stats["errors"] += 1
+                raise error
+            if response.status_code >= 400:
+                service_stats["errors"] += 1
+            return response
+
+        attempt += 1
+        service_stats["retries"] += 1
+        delay = HTTP_RETRY_BACKOFF * 2 ** (attempt - 1)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        logger.info(f"[HTTP] {name} {method} {url} failed "
+                    f"({error or response.status_code}), retry {attempt}/{HTTP_RETRIES} in {delay:.1f}s")
+        if response is not None:
+            await response.aclose()
+        await asyncio.sleep(delay)
+
+
+def pool_metrics():
+    metrics = {}
+    for name, client in clients.items():
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        metrics[name] = {
+            **stats.get(name, new_stats()),
+            "connections": len(connections),
+            "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+            "http2_connections": sum(1 for connection in connections if "HTTP/2" in connection.info()),
+        }
+    return metrics
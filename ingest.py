@@ -0,0 +1,74 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+
+import sonarr_snapshot
+from models import MediaData
+from service.media_service import add_media_batch, delete_media
+from settings import INGEST_WINDOW, INGEST_MAX_BATCH
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+ADD_EVENTS = ("MovieAdded", "SeriesAdd")
+DELETE_EVENTS = ("Grab", "MovieDelete", "SeriesDelete")
+
+# Latest event per title within the current window; a later event replaces an earlier one,
+# so an add followed by a Grab/Delete never reaches the database.
+buffer: Dict[Tuple[str, int], MediaData] = {}
+flush_task: Optional[asyncio.Task] = None
+background_flushes = set()
+
+
+def submit(media: MediaData) -> bool:
+    global flush_task
+
+    # Any Sonarr event (add, import, delete, rename) may change the series, so drop it from the snapshot.
+    if media.source_type == "SONARR" and media.internal_id:
+        sonarr_snapshot.invalidate(media.internal_id)
+
+    if media.event_type in ADD_EVENTS and not media.tmdb_id:
+        return False
+    if media.event_type not in ADD_EVENTS + DELETE_EVENTS:
+        return False
+
+    key = (media.source_type, media.internal_id)
+    buffer.pop(key, None)
+    buffer[key] = media
+
+    if len(buffer) >= INGEST_MAX_BATCH:
+        task = asyncio.create_task(flush())
+        background_flushes.add(task)
+        task.add_done_callback(background_flushes.discard)
+    elif flush_task is None or flush_task.done():
+        flush_task = asyncio.create_task(flush_later())
+    return True
+
+
+async def flush_later():
+    await asyncio.sleep(INGEST_WINDOW)
+    await flush()
+
+
+async def flush():
+    if not buffer:
+        return
+    events = list(buffer.values())
+    buffer.clear()
+
+    deletes = [media for media in events if media.event_type in DELETE_EVENTS]
+    adds = [media for media in events if media.event_type in ADD_EVENTS]
+    logger.info(f"[Ingest] Flushing {len(adds)} adds and {len(deletes)} deletes")
+
+    try:
+        for media in deletes:
+            await delete_media(media)
+        if adds:
+            await add_media_batch(adds)
+    except Exception as e:
+        logger.error(f"[Ingest] Failed to flush batch: {e}")
+
+
+async def close():
+    if flush_task is not None and not flush_task.done():
+        flush_task.cancel()
+    await flush()
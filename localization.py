@@ -1,11 +1,69 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
 import httpx
-from typing import Optional
-from settings import TMDB_API_KEY
+
+import database
+import http_clients
+from models import MediaData
+from settings import TMDB_LANGUAGE, TITLE_CACHE_SIZE, TITLE_CACHE_TTL, TITLE_CACHE_NEGATIVE_TTL
 from logger import get_logger
 
 logger = get_logger(__name__)
 
-TMDB_BASE_URL: str = "https://api.themoviedb.org/3"
+# (tmdb_id, media_type, language) -> (title or None for a cached miss, expires_on)
+title_cache: "OrderedDict[Tuple[int, str, str], Tuple[Optional[str], float]]" = OrderedDict()
+
+
+def get_media_type(media: MediaData) -> str:
+    return "movie" if media.source_type == "RADARR" else "tv"
+
+
+def cache_get(key) -> Optional[Tuple[Optional[str], float]]:
+    entry = title_cache.get(key)
+    if entry is None:
+        return None
+    if entry[1] <= time.time():
+        del title_cache[key]
+        return None
+    title_cache.move_to_end(key)
+    return entry
+
+
+def cache_put(key, title: Optional[str], expires_on: float):
+    title_cache[key] = (title, expires_on)
+    title_cache.move_to_end(key)
+    while len(title_cache) > TITLE_CACHE_SIZE:
+        title_cache.popitem(last=False)
+
+
+async def fetch_title(tmdb_id: int, media_type: str, language: str) -> Tuple[Optional[str], bool]:
+    """
+    Returns the title and whether the result may be cached; transient errors are not cached.
+    """
+    try:
+        response = await http_clients.request("tmdb", "GET", f"/{media_type}/{tmdb_id}", params={"language": language})
+        if response.status_code == 404:
+            return None, True
+        response.raise_for_status()
+        data = response.json()
+
+        return data.get("title") or data.get("name"), True
+
+    except httpx.HTTPStatusError as e:
+        logger.error(f"TMDb API error: {e.response.status_code} - {e.response.text}")
+    except Exception as e:
+        logger.error(f"Unexpected error when accessing TMDb API: {e}")
+
+    return None, False
+
+
+async def store_title(key, title: Optional[str]):
+    expires_on = time.time() + (TITLE_CACHE_TTL if title else TITLE_CACHE_NEGATIVE_TTL)
+    cache_put(key, title, expires_on)
+    await database.save_cached_title(*key, title, expires_on)
 
 
 async def get_ukrainian_title(tmdb_id: int, media_type: str = "tv") -> Optional[str]:
@@ -16,23 +74,47 @@ async def get_ukrainian_title(tmdb_id: int, media_type: str = "tv") -> Optional[
     :param media_type: 'tv' або 'movie'
     :return: Назва українською мовою або None
     """
-    url = f"{TMDB_BASE_URL}/{media_type}/{tmdb_id}?language=uk-UA"
-    headers = {
-        "Authorization": f"Bearer {TMDB_API_KEY}",
-        "Accept": "application/json"
-    }
+    if not tmdb_id:
+        return None
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
+    key = (tmdb_id, media_type, TMDB_LANGUAGE)
+    entry = cache_get(key)
+    if entry is None:
+        entry = (await database.get_cached_titles([key])).get(key)
+        if entry is not None:
+            cache_put(key, *entry)
+    if entry is not None:
+        return entry[0]
 
-            return data.get("title") or data.get("name")
+    title, cacheable = await fetch_title(tmdb_id, media_type, TMDB_LANGUAGE)
+    if cacheable:
+        await store_title(key, title)
+    return title
 
-    except httpx.HTTPStatusError as e:
-        logger.error(f"TMDb API error: {e.response.status_code} - {e.response.text}")
-    except Exception as e:
-        logger.error(f"Unexpected error when accessing TMDb API: {e}")
 
-    return None
+async def prefetch_titles(media_list: Iterable[MediaData]) -> Dict[Tuple[int, str, str], Optional[str]]:
+    keys = list(dict.fromkeys((media.tmdb_id, get_media_type(media), TMDB_LANGUAGE)
+                              for media in media_list if media.tmdb_id))
+    titles = {}
+    missing = []
+    for key in keys:
+        entry = cache_get(key)
+        if entry is None:
+            missing.append(key)
+        else:
+            titles[key] = entry[0]
+
+    for key, entry in (await database.get_cached_titles(missing)).items():
+        cache_put(key, *entry)
+        titles[key] = entry[0]
+
+    missing = [key for key in missing if key not in titles]
+    if missing:
+        logger.info(f"[Titles] Prefetching {len(missing)} titles from TMDb")
+    results = await asyncio.gather(*(fetch_title(*key) for key in missing))
+    for key, (title, cacheable) in zip(missing, results):
+        if cacheable:
+            await store_title(key, title)
+        titles[key] = title
+
+    return titles
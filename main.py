@@ -1,13 +1,20 @@
+import json
 from contextlib import asynccontextmanager
-
-from fastapi import FastAPI, Request
-
-from util import request_to_json
-from database import init_db, get_all_data
-from download import stop_all_downloads
-from service.media_service import add_media, delete_media
-from models import MediaData, map_sonarr_response, map_radarr_response
-from scheduler import start_grab_scheduler
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from database import init_db, close_db, get_all_data, stream_all_data, requeue_running_jobs
+import download
+import events
+import host_health
+from http_clients import start_clients, close_clients, pool_metrics
+import ingest
+import metrics
+import supervisor
+from service.media_service import drop_media
+from scheduler import start_grab_scheduler, shutdown
 from logger import get_logger
 
 logger = get_logger(__name__)
@@ -17,50 +24,134 @@ app = FastAPI()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_db()
+    await init_db()
+    await requeue_running_jobs()
+    await host_health.load()
+    await start_clients()
     await start_grab_scheduler()
     yield
+    await ingest.close()
+    await shutdown()
+    await host_health.save()
+    await close_clients()
+    await close_db()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
-@app.post("/webhook/sonarr")
+@app.post("/webhook/sonarr", status_code=202)
 async def sonarr_webhook(request: Request):
-    logger.info(f"Sadarr incoming request: {request.json()}")
+    with metrics.webhook_seconds.time("sonarr"):
+        media_data = await events.read_media_data(request, "SONARR")
+        if media_data is None:
+            metrics.webhook_events.inc("sonarr", "ignored")
+            return
+        logger.info(f"[Webhook] Sonarr {media_data.event_type}: {media_data.series_title} ({media_data.internal_id})")
+        # Only buffers the event; the batch is written and grabbed after the response is sent.
+        ingest.submit(media_data)
+    metrics.webhook_events.inc("sonarr", media_data.event_type)
+
+
+@app.post("/webhook/radarr", status_code=202)
+async def radarr_webhook(request: Request):
+    with metrics.webhook_seconds.time("radarr"):
+        media_data = await events.read_media_data(request, "RADARR")
+        if media_data is None:
+            metrics.webhook_events.inc("radarr", "ignored")
+            return
+        logger.info(f"[Webhook] Radarr {media_data.event_type}: {media_data.series_title} ({media_data.internal_id})")
+        ingest.submit(media_data)
+    metrics.webhook_events.inc("radarr", media_data.event_type)
 
-    body_json = request_to_json(request)
-    media_data: MediaData = await map_sonarr_response(body_json)
 
-    await handle_media(media_data)
+@app.get("/all")
+async def get_all(response: Response, cursor: Optional[int] = None, limit: Optional[int] = None,
+                  source_type: Optional[str] = None, created_from: Optional[str] = None,
+                  created_to: Optional[str] = None, has_local_title: Optional[bool] = None,
+                  stream: Optional[str] = None):
+    filters = dict(after_id=cursor, limit=limit, source_type=source_type, created_from=created_from,
+                   created_to=created_to, has_local_title=has_local_title)
 
+    if stream == "ndjson":
+        async def ndjson_lines():
+            async for media in stream_all_data(**filters):
+                yield json.dumps(media) + "\n"
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
 
-@app.post("/webhook/radarr")
-async def radarr_webhook(request: Request):
-    logger.info(f"Radarr incoming request: {request.json()}")
+    if stream == "json":
+        async def json_array():
+            separator = "["
+            async for media in stream_all_data(**filters):
+                yield separator + json.dumps(media)
+                separator = ","
+            yield "[]" if separator == "[" else "]"
+        return StreamingResponse(json_array(), media_type="application/json")
 
-    body_json = request_to_json(request)
-    media_data: MediaData = await map_radarr_response(body_json)
+    media_list = await get_all_data(**filters)
+    if limit and len(media_list) == limit:
+        response.headers["X-Next-Cursor"] = str(media_list[-1]["id"])
+    return media_list
 
-    await handle_media(media_data)
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-async def handle_media(media: MediaData):
-    if media.event_type in ("MovieAdded", "SeriesAdd") and media.tmdb_id:
-        await add_media(media)
 
-    if media.event_type in ("Grab", "MovieDelete", "SeriesDelete"):
-        await delete_media(media)
+@app.get("/http/pools")
+async def get_http_pools():
+    return pool_metrics()
 
 
-@app.get("/all")
+@app.get("/download/stop")
 async def get_all():
-    return get_all_data()
+    return download.stop_all_downloads()
 
 
-@app.get("/download/stop")
-async def get_all():
-    return stop_all_downloads()
+@app.get("/download/progress")
+async def get_download_progress():
+    return supervisor.get_progress()
+
+
+@app.get("/download/bandwidth")
+async def get_download_bandwidth():
+    return supervisor.get_throughput()
+
+
+@app.get("/download/hosts")
+async def get_download_hosts():
+    return host_health.get_health()
+
+
+@app.post("/download/jobs/{job_id}/pause")
+async def pause_download_job(job_id: int):
+    state = await download.pause_job(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No pending or running download job with this id")
+    return {"job_id": job_id, "state": state}
+
+
+@app.post("/download/jobs/{job_id}/resume")
+async def resume_download_job(job_id: int):
+    if not await download.resume_job(job_id):
+        raise HTTPException(status_code=404, detail="No paused download job with this id")
+    return {"job_id": job_id, "state": "pending"}
+
+
+@app.post("/download/jobs/{job_id}/cancel")
+async def cancel_download_job(job_id: int):
+    state = await download.cancel_job(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No unfinished download job with this id")
+    return {"job_id": job_id, "state": state}
+
+
+@app.post("/download/titles/{internal_id}/cancel")
+async def cancel_title(internal_id: int):
+    if not await drop_media(internal_id):
+        raise HTTPException(status_code=404, detail="Title is not stored or being grabbed")
+    return {"internal_id": internal_id, "state": "cancelled"}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,140 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Everything runs on the event loop thread, so updates are plain dict operations without locks;
+# an observation costs a dict lookup and a bisect, cheap enough to leave on for every request.
+PREFIX = "hook2stream_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DOWNLOAD_BUCKETS = (10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+registry: List["Metric"] = []
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.description = description
+        self.labels = labels
+        self.values: Dict[Tuple, float] = {}
+        # Read at scrape time instead of being updated on the hot path.
+        self.function: Optional[Callable[[], Dict[Tuple, float]]] = None
+        registry.append(self)
+
+    def set_function(self, function: Callable[[], Dict[Tuple, float]]):
+        self.function = function
+
+    def samples(self) -> List[str]:
+        values = self.function() if self.function else self.values
+        return [f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+                for labels, value in sorted(values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # Per label set: [count per bucket (not cumulative), sum, count].
+        self.series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                bound_label = 'le="' + format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, bound_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+webhook_seconds = Histogram("webhook_seconds", "Time to accept a Sonarr/Radarr webhook.", ("source",))
+webhook_events = Counter("webhook_events_total", "Webhooks received by source and event type.", ("source", "event"))
+
+scrape_seconds = Histogram("scrape_seconds", "Time spent in each search_links stage.", ("stage",))
+scrape_errors = Counter("scrape_errors_total", "Failed scrape requests and probes by stage.", ("stage",))
+
+download_seconds = Histogram("download_seconds", "Duration of one download attempt by backend and outcome.",
+                             ("backend", "state"), DOWNLOAD_BUCKETS)
+download_bytes = Counter("download_bytes_total", "Bytes of finished and failed download attempts by backend.",
+                         ("backend",))
+ytdlp_exits = Counter("ytdlp_exits_total", "yt-dlp runs by exit code, or the reason it was killed.", ("code",))
+download_failovers = Counter("download_failovers_total", "Downloads moved to another mirror.")
+hls_hedged = Counter("hls_hedged_requests_total", "Duplicate requests sent for stalled HLS segments.")
+downloads_running = Gauge("downloads_running", "Downloads running right now.")
+download_speed = Gauge("download_speed_bytes", "Current speed of all running downloads, in bytes per second.")
+
+import_seconds = Histogram("import_seconds", "Duration of a Sonarr/Radarr manual import call.", ("service",))
+imports = Counter("imports_total", "Manual import calls by service and HTTP status.", ("service", "status"))
+
+grab_job_seconds = Histogram("grab_job_seconds", "Duration of a recovery sweep.")
+grab_job_titles = Histogram("grab_job_titles", "Titles queued per recovery sweep.", buckets=COUNT_BUCKETS)
+grab_backlog_age = Gauge("grab_backlog_age_seconds", "Age of the oldest title found by the last recovery sweep.")
+grab_queue_length = Gauge("grab_queue_length", "Titles waiting for a grab worker.")
+
+http_requests = Counter("http_requests_total", "Outgoing HTTP requests, retries and errors by service.",
+                        ("service", "kind"))
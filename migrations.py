@@ -0,0 +1,156 @@
+import sqlite3
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Applied in order; the last applied version is stored in PRAGMA user_version.
+# Never edit a released migration, add a new one instead.
+MIGRATIONS = [
+    (1, "base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS media_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT UNIQUE,
+            source_type TEXT NOT NULL,
+            internal_id INTEGER UNIQUE,
+            created_on TIMESTAMP,
+            local_title TEXT,
+            tmdbId INTEGER UNIQUE,
+            imdbId TEXT UNIQUE,
+            tvdbId INTEGER UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS monitored_seasons (
+            internal_id INTEGER,
+            season_number INTEGER,
+            PRIMARY KEY (internal_id, season_number),
+            FOREIGN KEY (internal_id) REFERENCES media_data(internal_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS title_cache (
+            tmdb_id INTEGER,
+            media_type TEXT,
+            language TEXT,
+            title TEXT,
+            expires_on REAL,
+            PRIMARY KEY (tmdb_id, media_type, language)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS page_cache (
+            url TEXT PRIMARY KEY,
+            page_type TEXT,
+            body TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            expires_on REAL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS download_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            internal_id INTEGER,
+            season INTEGER,
+            episode INTEGER,
+            url TEXT,
+            filename TEXT UNIQUE,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER,
+            error TEXT,
+            next_attempt_on REAL NOT NULL DEFAULT 0,
+            updated_on TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "cascade monitored seasons on media delete", [
+        """
+        CREATE TABLE monitored_seasons_new (
+            internal_id INTEGER,
+            season_number INTEGER,
+            PRIMARY KEY (internal_id, season_number),
+            FOREIGN KEY (internal_id) REFERENCES media_data(internal_id) ON DELETE CASCADE
+        )
+        """,
+        # Orphans left behind by deletes before this migration are dropped here.
+        """
+        INSERT INTO monitored_seasons_new (internal_id, season_number)
+        SELECT internal_id, season_number FROM monitored_seasons
+        WHERE internal_id IN (SELECT internal_id FROM media_data)
+        """,
+        "DROP TABLE monitored_seasons",
+        "ALTER TABLE monitored_seasons_new RENAME TO monitored_seasons",
+        """
+        DELETE FROM download_jobs
+        WHERE internal_id NOT IN (SELECT internal_id FROM media_data WHERE internal_id IS NOT NULL)
+        """,
+    ]),
+    (3, "indexes for scheduler and caches", [
+        "CREATE INDEX IF NOT EXISTS idx_media_data_created_on ON media_data (created_on)",
+        "CREATE INDEX IF NOT EXISTS idx_download_jobs_title ON download_jobs (internal_id, season, state)",
+        "CREATE INDEX IF NOT EXISTS idx_page_cache_expires_on ON page_cache (expires_on)",
+        "CREATE INDEX IF NOT EXISTS idx_title_cache_expires_on ON title_cache (expires_on)",
+    ]),
+    (4, "media grab status", [
+        "ALTER TABLE media_data ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'",
+    ]),
+    (5, "probed source height", [
+        "ALTER TABLE download_jobs ADD COLUMN height INTEGER",
+    ]),
+    (6, "mirror failover", [
+        "ALTER TABLE download_jobs ADD COLUMN alternatives TEXT",
+        """
+        CREATE TABLE IF NOT EXISTS host_health (
+            host TEXT PRIMARY KEY,
+            latency REAL,
+            error_rate REAL NOT NULL,
+            samples INTEGER NOT NULL,
+            updated_on REAL
+        )
+        """,
+    ]),
+    (7, "grab leases", [
+        "ALTER TABLE media_data ADD COLUMN worker TEXT",
+        "ALTER TABLE media_data ADD COLUMN lease_expires_on REAL NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_media_data_lease_expires_on ON media_data (lease_expires_on)",
+    ]),
+    (8, "requested job states", [
+        # Pause/cancel asked through the API for an episode running in a worker process.
+        "ALTER TABLE download_jobs ADD COLUMN requested_state TEXT",
+    ]),
+    (9, "title attempts", [
+        "ALTER TABLE media_data ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE media_data ADD COLUMN next_attempt_on REAL NOT NULL DEFAULT 0",
+    ]),
+]
+
+
+def migrate(conn: sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    pending = [migration for migration in MIGRATIONS if migration[0] > version]
+    if not pending:
+        return
+
+    # Table rebuilds need foreign keys off, and the pragma is ignored inside a transaction.
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for number, description, statements in pending:
+            logger.info(f"[DB] Applying migration {number}: {description}")
+            conn.execute("BEGIN")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+    violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+    if violations:
+        logger.error(f"[DB] Foreign key violations after migration: {violations}")
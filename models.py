@@ -1,6 +1,5 @@
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 
 class MediaData(BaseModel):
@@ -15,63 +14,47 @@ class MediaData(BaseModel):
     local_title: Optional[str]
 
 
-async def map_sonarr_response(body_json) -> MediaData:
-    event_type = body_json.get("eventType")
-    series_title = None
-    internal_id = None
-    created_on = None
-    tmdb_id = None
-    imdb_id = None
-    tvdb_id = None
-
-    if "series" in body_json and isinstance(body_json["series"], dict):
-        series_title = body_json["series"].get("title")
-        created_on = str(datetime.now())
-        tmdb_id = body_json["series"].get("tmdbId")
-        internal_id = body_json["series"].get("id")
-        imdb_id = body_json["series"].get("imdbId")
-        tvdb_id = body_json["series"].get("tvdbId")
-
-    return MediaData(
-        internal_id=internal_id,
-        created_on=created_on,
-        source_type="SONARR",
-        event_type=event_type,
-        imdb_id=imdb_id,
-        series_title=series_title,
-        tmdb_id=tmdb_id,
-        tvdb_id=tvdb_id,
-        local_title=None
-    )
-
-
-async def map_radarr_response(body_json) -> MediaData:
-    event_type = body_json.get("eventType")
-    series_title = None
-    internal_id = None
-    created_on = None
-    tmdb_id = None
-    imdb_id = None
-    tvdb_id = None
-    local_title = None
-
-    movie = body_json.get("movie", {})
-
-    if isinstance(movie, dict):
-        series_title = movie.get("title")
-        created_on = str(datetime.now())
-        tmdb_id = movie.get("tmdbId")
-        internal_id = movie.get("id")
-        imdb_id = movie.get("imdbId")
-
-    return MediaData(
-        internal_id=internal_id,
-        created_on=created_on,
-        source_type="RADARR",
-        event_type=event_type,
-        imdb_id=imdb_id,
-        series_title=series_title,
-        tmdb_id=tmdb_id,
-        tvdb_id=tvdb_id,
-        local_title=local_title
-    )
+class EpisodeResult(BaseModel):
+    episode: Optional[int]
+    filename: str
+    success: bool
+    error: Optional[str] = None
+    height: Optional[int] = None
+
+
+class DownloadProgress(BaseModel):
+    job_id: int
+    filename: str
+    state: str = "running"
+    downloaded_bytes: int = 0
+    # Part of downloaded_bytes that an earlier run already left on disk.
+    resumed_bytes: int = 0
+    total_bytes: Optional[int] = None
+    speed: Optional[float] = None
+    eta: Optional[int] = None
+    average_speed: Optional[float] = None
+    rate_limit: Optional[int] = None
+    started_on: float
+    updated_on: float
+    error: Optional[str] = None
+    # Why the host failed (an HTTP status, a broken connection or a slow mirror); None when the failure was ours.
+    host_error: Optional[str] = None
+
+
+class DownloadReport(BaseModel):
+    folder: str
+    results: List[EpisodeResult] = []
+
+    @property
+    def succeeded(self) -> List[EpisodeResult]:
+        return [result for result in self.results if result.success]
+
+    @property
+    def failed(self) -> List[EpisodeResult]:
+        return [result for result in self.results if not result.success]
+
+    @property
+    def height(self) -> Optional[int]:
+        # One import covers the whole folder, so report the lowest quality in it.
+        heights = [result.height for result in self.succeeded if result.height]
+        return min(heights) if heights else None
@@ -0,0 +1,47 @@
+import time
+from typing import Awaitable, Callable, Dict
+
+import httpx
+
+import database
+from settings import PAGE_CACHE_TTL
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+stats: Dict[str, int] = {"hits": 0, "revalidated": 0, "misses": 0}
+
+
+async def fetch_page(url: str, page_type: str, send: Callable[..., Awaitable[httpx.Response]]) -> str:
+    """
+    Returns the body of url, served from the cache while fresh and revalidated with
+    ETag/Last-Modified once stale. send(url, headers) performs the actual request.
+    """
+    ttl = PAGE_CACHE_TTL.get(page_type, 0)
+    if ttl <= 0:
+        response = await send(url, {})
+        response.raise_for_status()
+        return response.text
+
+    cached = await database.get_cached_page(url)
+    if cached and cached["expires_on"] > time.time():
+        stats["hits"] += 1
+        return cached["body"]
+
+    headers = {}
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = await send(url, headers)
+    if response.status_code == 304 and cached:
+        stats["revalidated"] += 1
+        await database.touch_cached_page(url, time.time() + ttl)
+        return cached["body"]
+
+    response.raise_for_status()
+    stats["misses"] += 1
+    await database.save_cached_page(url, page_type, response.text, response.headers.get("ETag"),
+                                    response.headers.get("Last-Modified"), time.time() + ttl)
+    return response.text
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+import hls
+import host_health
+import http_clients
+import metrics
+from settings import SOURCE_POLICY, SOURCE_MIN_HEIGHT, PROBE_TIMEOUT, PROBE_CONCURRENCY, PROBE_BYTES
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+probe_slots = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+
+class Source(NamedTuple):
+    url: str
+    height: Optional[int] = None
+    bandwidth: Optional[int] = None
+    # Seconds until the first byte of the first segment arrived.
+    latency: Optional[float] = None
+    # Lower ranked sources of the same episode, tried in order when this one fails or is too slow.
+    alternatives: Tuple["Source", ...] = ()
+
+
+async def measure(url: str) -> Source:
+    variant, segments = await hls.resolve_playlist(url)
+    if not segments:
+        raise hls.Unsupported("empty playlist")
+
+    client = http_clients.get_client("hls")
+    started = time.monotonic()
+    latency = None
+    received = 0
+    # Only the head of the segment is asked for and read to the end, so the connection goes back to the pool.
+    # A host that ignores the range is cut off after PROBE_BYTES.
+    async with client.stream("GET", segments[0].url, headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"}) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            if latency is None:
+                latency = time.monotonic() - started
+            received += len(chunk)
+            if received >= PROBE_BYTES:
+                break
+    if latency is None:
+        latency = time.monotonic() - started
+
+    if variant is None:
+        return Source(url=url, latency=latency)
+    return Source(url=url, height=variant.height or None, bandwidth=variant.bandwidth or None, latency=latency)
+
+
+async def probe_source(url: str) -> Optional[Source]:
+    # The timeout starts once a slot is free; waiting behind other probes is not the host's fault.
+    async with probe_slots:
+        try:
+            source = await asyncio.wait_for(measure(url), PROBE_TIMEOUT)
+        except Exception as e:
+            logger.info(f"[Probe] {url} failed: {e!r}")
+            # Our own deadline does not count against the host.
+            if host_health.is_host_error(e):
+                host_health.record_failure(url)
+            metrics.scrape_errors.inc("probe")
+            return None
+    host_health.record_success(url, source.latency)
+    logger.info(f"[Probe] {url}: {source.height}p, {source.bandwidth} b/s, first byte in {source.latency:.2f}s")
+    return source
+
+
+def is_adequate(source: Source) -> bool:
+    return (source.height or 0) >= SOURCE_MIN_HEIGHT
+
+
+def rank(sources: List[Source]) -> List[Source]:
+    """
+    Adequate sources on healthy hosts first, then by SOURCE_POLICY: "latency" for the fastest mirror,
+    "quality" for the best picture. Latency is weighed by the host's error rate.
+    """
+    if SOURCE_POLICY == "quality":
+        def key(source):
+            return (not is_adequate(source), host_health.is_unhealthy(source.url), -(source.height or 0),
+                    -(source.bandwidth or 0), host_health.get_score(source.url, source.latency))
+    else:
+        def key(source):
+            return (not is_adequate(source), host_health.is_unhealthy(source.url),
+                    host_health.get_score(source.url, source.latency), -(source.height or 0))
+    return sorted(sources, key=key)
+
+
+async def probe_all(urls: List[str]) -> List[Source]:
+    sources = await asyncio.gather(*(probe_source(url) for url in dict.fromkeys(urls)))
+    return rank([source for source in sources if source is not None])
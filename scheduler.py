@@ -1,61 +1,227 @@
+import asyncio
+import itertools
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 import database
+import download
+import host_health
+import metrics
+import supervisor
 from database import get_media_added_more_than
+from localization import prefetch_titles, get_media_type
 from logger import get_logger
+from models import MediaData
 from service.radarr_service import handle_ranarr_media
 from service.sonarr_service import handle_sonarr_media
+from settings import (TMDB_LANGUAGE, SCHEDULER_INTERVAL, GRAB_WORKERS, GRAB_DELAY_MINUTES, DB_MAINTENANCE_HOURS,
+                      EMBEDDED_WORKERS, WORKER_ID, GRAB_LEASE_SECONDS, GRAB_MAX_ATTEMPTS)
 
 logger = get_logger(__name__)
 
 
 scheduler = AsyncIOScheduler()
-job_is_running = False
+grab_queue: "asyncio.PriorityQueue[Tuple[tuple, int, MediaData]]" = asyncio.PriorityQueue()
+queue_order = itertools.count()
+# Titles that are queued or being grabbed, so the same title never runs twice at once.
+active_titles: Set[Tuple[str, int]] = set()
+# Titles added by a webhook, waiting for their grab delay to pass.
+pending_grabs: Dict[Tuple[str, int], asyncio.Task] = {}
+workers: List[asyncio.Task] = []
+# Owner of this process's grab leases, which keep other processes off the titles it is grabbing.
+worker_id = WORKER_ID or f"{socket.gethostname()}:{os.getpid()}"
 
+metrics.grab_queue_length.set_function(lambda: {(): grab_queue.qsize()})
 
-async def grab_job():
-    global job_is_running
 
-    if job_is_running:
-        logger.info("[Grab Job] Previous job still running. Skipping new launch.")
+def get_title_key(media: MediaData) -> Tuple[str, int]:
+    return media.source_type, media.internal_id
+
+
+async def get_priority(media: MediaData) -> tuple:
+    # Movies first, then series by number of monitored seasons, oldest first within each group.
+    if media.source_type == 'RADARR':
+        return 0, 0, media.created_on
+    return 1, len(await database.get_monitored_seasons(media.internal_id)), media.created_on
+
+
+async def grab_media(media: MediaData):
+    logger.info(f"[Grab Job] Need to grab: {media.series_title} added at {media.created_on}")
+    await database.set_media_status(media.internal_id, "grabbing")
+
+    title = download.open_title(media.internal_id)
+    failed = False
+    try:
+        if media.source_type == 'SONARR':
+            await handle_sonarr_media(media)
+        if media.source_type == 'RADARR':
+            await handle_ranarr_media(media)
+    except Exception as e:
+        logger.error(f"[Grab Job] Error for {media.series_title}: {e}")
+        # A failed scrape or import may leave downloaded files behind that the next grab still has to import.
+        failed = True
+    finally:
+        download.close_title(media.internal_id)
+
+    if title.reason == "cancelled":
+        logger.info(f"[Grab Job] {media.series_title} was cancelled and dropped.")
+        return
+    if title.reason == "lost":
+        logger.info(f"[Grab Job] {media.series_title} was taken over or deleted, leaving it.")
         return
 
-    job_is_running = True
-    logger.info("[Grab Job] Running scheduled grab job...")
-    media_list = get_media_added_more_than(3)
+    unfinished = await database.count_unfinished_jobs(media.internal_id)
+    if unfinished or failed:
+        if await database.finish_title_attempt(media.internal_id, failed) == "failed":
+            logger.error(f"[Grab Job] {media.series_title} failed {GRAB_MAX_ATTEMPTS} times in a row, giving up.")
+            return
+        logger.info(f"[Grab Job] {media.series_title} has {unfinished} episodes left to retry.")
+        return
 
-    if not media_list:
-        logger.info("[Grab Job] No media found to grab.")
-        job_is_running = False
+    logger.info(f"[Grab Job] Finished with {media.series_title} push to delete.")
+    await database.delete_from_db_by_ids(media.internal_id, media.tmdb_id, media.imdb_id, media.tvdb_id)
+
+
+async def enqueue_media(media: MediaData):
+    key = get_title_key(media)
+    priority = await get_priority(media)
+    pending_grabs.pop(key, None)
+    if key in active_titles:
         return
-    try:
-        for media in media_list:
-            logger.info(f"[Grab Job] Need to grab: {media.series_title} added at {media.created_on}")
+    active_titles.add(key)
+    grab_queue.put_nowait((priority, next(queue_order), media))
 
-            if media.source_type == 'SONARR':
-                await handle_sonarr_media(media)
-            if media.source_type == 'RADARR':
-                await handle_ranarr_media(media)
 
-            logger.info(f"[Grab Job] Finished with {media.series_title} push to delete.")
-            database.delete_from_db_by_ids(media.internal_id, media.tmdb_id, media.imdb_id, media.tvdb_id)
+async def enqueue_later(media: MediaData, delay: float):
+    await asyncio.sleep(delay)
+    await enqueue_media(media)
 
-    except Exception as e:
-        logger.error(f"[Grab Job] Error: {e}")
-        database.delete_from_db_by_ids(media.internal_id, media.tmdb_id, media.imdb_id, media.tvdb_id)
 
-    finally:
-        job_is_running = False
-        logger.info("[Grab Job] Finished.")
+def schedule_grab(media: MediaData):
+    if not EMBEDDED_WORKERS:
+        # Stored titles are claimed by a worker process once they are GRAB_DELAY_MINUTES old.
+        return
+    key = get_title_key(media)
+    if key in pending_grabs or key in active_titles:
+        return
+    delay = GRAB_DELAY_MINUTES * 60
+    pending_grabs[key] = asyncio.create_task(enqueue_later(media, delay))
+    logger.info(f"[Scheduler] {media.series_title} will be grabbed in {delay:.0f}s")
+
+
+def cancel_grab(media: MediaData):
+    task = pending_grabs.pop(get_title_key(media), None)
+    if task:
+        task.cancel()
+        logger.info(f"[Scheduler] Cancelled pending grab of {media.series_title}")
+
+
+async def grab_worker(number: int):
+    while True:
+        _, _, media = await grab_queue.get()
+        try:
+            # The title may have been grabbed or deleted in Sonarr/Radarr while it was queued,
+            # or be held by a worker process.
+            if await database.claim_title(worker_id, GRAB_LEASE_SECONDS, media.internal_id):
+                try:
+                    await grab_media(media)
+                finally:
+                    await database.release_title(worker_id, media.internal_id, await get_retry_after(media.internal_id))
+        except Exception as e:
+            logger.error(f"[Grab Worker {number}] Error for {media.series_title}: {e}")
+        finally:
+            active_titles.discard(get_title_key(media))
+            grab_queue.task_done()
+
+
+async def get_retry_after(internal_id: int) -> float:
+    # Seconds until the title or its next episode may be retried; a title with neither is tried again after
+    # a sweep interval.
+    next_attempt_on = await database.get_next_attempt_on(internal_id)
+    if next_attempt_on is None:
+        return SCHEDULER_INTERVAL * 60
+    return max(next_attempt_on - time.time(), 0)
+
+
+async def renew_leases():
+    held = list(download.title_tokens)
+    if not held:
+        return
+    kept = set(await database.renew_title_leases(worker_id, held, GRAB_LEASE_SECONDS))
+    for internal_id in held:
+        if internal_id not in kept:
+            # Deleted, or claimed by another worker after a missed heartbeat; either way it is not ours anymore.
+            logger.error(f"[Lease] Lost title {internal_id}, stopping it here")
+            download.cancel_title(internal_id, "lost")
+    await download.apply_requested_states()
+
+
+def add_worker_jobs():
+    scheduler.add_job(renew_leases, IntervalTrigger(seconds=max(GRAB_LEASE_SECONDS // 3, 1)))
+    scheduler.add_job(supervisor.apply_bandwidth_schedule, IntervalTrigger(minutes=1))
+    scheduler.add_job(host_health.save, IntervalTrigger(minutes=1))
+
+
+async def start_worker_scheduler():
+    add_worker_jobs()
+    scheduler.start()
+
+
+async def grab_job():
+    with metrics.grab_job_seconds.time():
+        await sweep()
+
+
+async def sweep():
+    logger.info("[Grab Job] Running recovery sweep...")
+    media_list = [media for media in await get_media_added_more_than(GRAB_DELAY_MINUTES)
+                  if get_title_key(media) not in active_titles and get_title_key(media) not in pending_grabs]
+    metrics.grab_job_titles.observe(len(media_list))
+    oldest = min((datetime.fromisoformat(media.created_on) for media in media_list if media.created_on), default=None)
+    metrics.grab_backlog_age.set((datetime.now() - oldest).total_seconds() if oldest else 0)
+
+    if not media_list:
+        logger.info("[Grab Job] No new media found to grab.")
+        return
+
+    titles = await prefetch_titles(media_list)
+    for media in media_list:
+        if not media.local_title:
+            media.local_title = titles.get((media.tmdb_id, get_media_type(media), TMDB_LANGUAGE))
+
+        await enqueue_media(media)
+
+    logger.info(f"[Grab Job] Queued {len(media_list)} titles, {grab_queue.qsize()} waiting.")
 
 
 async def start_grab_scheduler():
-    scheduler.add_job(grab_job, IntervalTrigger(minutes=5))
+    scheduler.add_job(database.maintain_db, IntervalTrigger(hours=DB_MAINTENANCE_HOURS))
+    if not EMBEDDED_WORKERS:
+        scheduler.start()
+        logger.info("[Scheduler] Serving the API only, titles are grabbed by worker processes")
+        return
+
+    for number in range(GRAB_WORKERS):
+        workers.append(asyncio.create_task(grab_worker(number)))
+    # Webhooks schedule their own grabs; the sweep only recovers titles left over from a restart.
+    scheduler.add_job(grab_job, IntervalTrigger(minutes=SCHEDULER_INTERVAL), next_run_time=datetime.now())
+    add_worker_jobs()
     scheduler.start()
-    logger.info("[Scheduler] Started Grab Job every 5 minutes")
+    logger.info(f"[Scheduler] Started recovery sweep every {SCHEDULER_INTERVAL} minutes with {GRAB_WORKERS} workers")
 
 
 async def shutdown():
     scheduler.shutdown()
+    for task in pending_grabs.values():
+        task.cancel()
+    pending_grabs.clear()
+    for worker in workers:
+        worker.cancel()
+    workers.clear()
     logger.info("[Scheduler] Shutdown")
@@ -1,92 +1,159 @@
+import asyncio
 import json
-import time
 import urllib.parse
+from typing import List, Optional
 
-import requests
+import httpx
 from bs4 import BeautifulSoup
 
+import html_parser
+import http_clients
+import metrics
+import page_cache
+import probe
 from models import MediaData
-from settings import USER_AGENT, HOST, SEARCH_QUERY
+from probe import Source
+from rate_limiter import TokenBucket
+from settings import HOST, SEARCH_QUERY, SCRAPE_RATE, SCRAPE_BURST, SCRAPE_CONCURRENCY
 from logger import get_logger
 
 logger = get_logger(__name__)
 
+rate_limiter = TokenBucket(SCRAPE_RATE, SCRAPE_BURST)
 
-def get_document(url):
-    headers = {
-        "User-Agent": USER_AGENT
-    }
-    response = requests.get(url, headers=headers, timeout=10)
-    response.raise_for_status()
-    return BeautifulSoup(response.text, "html.parser")
 
+class NotFound(Exception):
+    """
+    The site has no page for the title (yet); the grab is retried later.
+    """
 
-def search_film(media: MediaData, season: int = None):
-    links = []
-    title_candidates = [media.local_title, media.series_title]
 
-    for title in title_candidates:
-        link_to_film = try_get_link_to_film(title, season)
-        if link_to_film:
-            break
-    else:
-        logger.info("Film was not found.")
-        return []
-
-    film_page_url = HOST + link_to_film["href"]
-    film_data = get_film_data(film_page_url)
-    embed_urls = get_embed_url(film_data, season)
-
-    for url in embed_urls:
-        time.sleep(1)
-        embed_doc = get_document(url)
-        if not embed_doc:
-            logger.info(f"Embed link not found: {url}")
+async def send_request(url, headers):
+    await rate_limiter.acquire()
+    return await http_clients.request("uaserial", "GET", url, headers=headers)
+
+
+async def get_page(url, page_type: Optional[str] = None) -> str:
+    return await page_cache.fetch_page(url, page_type, send_request)
+
+
+async def get_document(url, page_type: Optional[str] = None):
+    return BeautifulSoup(await get_page(url, page_type), "html.parser")
+
+
+async def search_film(media: MediaData, season: int = None):
+    with metrics.scrape_seconds.time("search_film"):
+        film_data = await find_film_data(media, season)
+        if not film_data:
             return []
-        video_options = embed_doc.select("option[data-type=link]")
-        links.append(get_source_url(video_options))
+        return await get_episode_links(film_data, season)
 
-    return links
 
+async def find_film_data(media: MediaData, season: int = None):
+    title_candidates = [media.local_title, media.series_title]
 
-def try_get_link_to_film(title, season: int = None):
+    with metrics.scrape_seconds.time("search"):
+        for title in title_candidates:
+            link_to_film = await try_get_link_to_film(title, season)
+            if link_to_film:
+                break
+        else:
+            logger.info("Film was not found.")
+            metrics.scrape_errors.inc("search")
+            return None
+
+    film_page_url = HOST + link_to_film
+    with metrics.scrape_seconds.time("film"):
+        return await get_film_data(film_page_url)
+
+
+async def get_episode_links(film_data, season: int = None,
+                            episodes: Optional[List[int]] = None) -> List[Optional[Source]]:
+    with metrics.scrape_seconds.time("embed_urls"):
+        embed_urls = await get_embed_url(film_data, season)
+    if episodes is not None:
+        # Only the requested episodes are fetched, in their order; ones the site does not have yet stay None.
+        embed_urls = [embed_urls[episode - 1] if 0 < episode <= len(embed_urls) else None for episode in episodes]
+
+    slots = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+
+    async def fetch_source(url):
+        if not url:
+            return None
+        async with slots:
+            try:
+                with metrics.scrape_seconds.time("embed"):
+                    embed_page = await get_page(url, "embed")
+            except httpx.HTTPError as e:
+                logger.info(f"Embed link not found: {url} ({e})")
+                metrics.scrape_errors.inc("embed")
+                return None
+        # Outside the scrape slot: probes queue on their own limit in probe.probe_slots.
+        with metrics.scrape_seconds.time("probe"):
+            return await get_best_source(html_parser.extract_link_options(embed_page))
+
+    return list(await asyncio.gather(*(fetch_source(url) for url in embed_urls)))
+
+
+async def try_get_link_to_film(title, season: int = None):
+    if not title:
+        return None
     search_url = get_search_url(title, season)
-    search_doc = get_document(search_url)
-    link_to_film = search_doc.select_one("div#block-search-page div.row div.col div.item a[href]")
-    return link_to_film
+    search_page = await get_page(search_url, "search")
+    return html_parser.extract_search_link(search_page)
 
 
 def get_source_url(video_options):
-    for option in video_options:
-        value = option.get("value", "")
+    for value in video_options:
         if "ashdi" in value:
             return value
 
 
-def get_embed_url(film_data, season):
+def get_mirrors(url, video_options):
+    # The same stream path on another host is a mirror; any other option is a different voiceover or player.
+    parsed = urllib.parse.urlsplit(url)
+    mirrors = []
+    for value in video_options:
+        if not value or not value.startswith("http"):
+            continue
+        other = urllib.parse.urlsplit(value)
+        if other.netloc != parsed.netloc and (other.path, other.query) == (parsed.path, parsed.query):
+            mirrors.append(value)
+    return mirrors
+
+
+async def get_best_source(video_options) -> Optional[Source]:
+    # The track is chosen by the same rule for every episode, so a season keeps one voiceover;
+    # only its mirrors are probed and ranked, and failover never switches the language.
+    url = get_source_url(video_options)
+    if not url:
+        return None
+    mirrors = get_mirrors(url, video_options)
+    sources = await probe.probe_all([url, *mirrors])
+    if sources:
+        return sources[0]._replace(alternatives=tuple(sources[1:]))
+    return Source(url=url, alternatives=tuple(Source(url=mirror) for mirror in mirrors))
+
+
+async def get_embed_url(film_data, season):
     if film_data['@type'] == 'TVSeason':
-        return get_tv_embed_url(film_data, season)
+        return await get_tv_embed_url(film_data, season)
     elif film_data['@type'] == 'Movie':
-        return get_movie_embed_url(film_data)
+        return [await get_movie_embed_url(film_data)]
+    return []
 
 
-def get_movie_embed_url(film_data):
+async def get_movie_embed_url(film_data):
     film_page_url = film_data['url']
-    film_doc = get_document(film_page_url)
-    embed_iframe = film_doc.select_one("div.video-holder iframe#embed")
-    return HOST + embed_iframe["src"]
+    film_page = await get_page(film_page_url, "film")
+    return HOST + html_parser.extract_embed_src(film_page)
 
 
-def get_tv_embed_url(film_data, season):
+async def get_tv_embed_url(film_data, season):
     season = season - 1 or 0
     film_page_url = film_data['partOfTVSeries']['containsSeason'][season]['url']
-    film_doc = get_document(film_page_url)
-    selector = f"select#select-series option[data-series-number]"
-    embed_iframe = film_doc.select(selector)
-    links = list()
-    for option in embed_iframe:
-        links.append(HOST + option["value"])
-    return links
+    film_page = await get_page(film_page_url, "season")
+    return [HOST + value for value in html_parser.extract_series_options(film_page)]
 
 
 def get_search_url(film_name_r, season: int = None):
@@ -99,12 +166,10 @@ def get_search_url(film_name_r, season: int = None):
     return search_url
 
 
-def get_film_data(url):
-    film_page = get_document(url)
-    script_tag = film_page.find('script', type='application/ld+json')
-    if script_tag:
-        json_data = script_tag.string
-
+async def get_film_data(url):
+    film_page = await get_page(url, "film")
+    json_data = html_parser.extract_ld_json(film_page)
+    if json_data:
         try:
             data = json.loads(json_data)
             return data
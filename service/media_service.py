@@ -1,7 +1,13 @@
-import sonarr
-from database import add_to_db, delete_from_db_by_ids
-from localization import get_ukrainian_title
+import asyncio
+from typing import List
+
+import download
+import scheduler
+import sonarr_snapshot
+from database import add_to_db, delete_from_db_by_ids, media_exists
+from localization import prefetch_titles, get_media_type
 from models import MediaData
+from settings import TMDB_LANGUAGE
 
 from logger import get_logger
 
@@ -9,8 +15,9 @@ logger = get_logger(__name__)
 
 
 async def delete_media(media_data: MediaData):
+    scheduler.cancel_grab(media_data)
     if media_data.tmdb_id or media_data.imdb_id or media_data.tvdb_id or media_data.internal_id:
-        delete_from_db_by_ids(
+        await delete_from_db_by_ids(
             internal_id=media_data.internal_id,
             tmdb_id=media_data.tmdb_id,
             imdb_id=media_data.imdb_id,
@@ -25,14 +32,47 @@ async def delete_media(media_data: MediaData):
         logger.info(f"No valid ID provided for title {media_data.series_title}")
 
 
+async def drop_media(internal_id: int) -> bool:
+    # Stops the title's running downloads and forgets it; other titles keep going.
+    running = download.cancel_title(internal_id)
+    stored = await media_exists(internal_id)
+    if stored:
+        await delete_from_db_by_ids(internal_id=internal_id)
+    logger.info(f"Dropped title {internal_id}")
+    return running or stored
+
+
 async def add_media(media_data: MediaData):
-    logger.info(f"Add Event Body: {media_data}")
-    seasons = await sonarr.get_monitored_seasons(media_data.internal_id)
-    local_title = await get_ukrainian_title(media_data.tmdb_id)
-    media_data.local_title = local_title
+    await add_media_batch([media_data])
+
+
+async def get_seasons(media_data: MediaData):
+    if media_data.source_type != "SONARR":
+        return []
+    return await sonarr_snapshot.get_monitored_seasons(media_data.internal_id)
 
-    add_to_db(media_data, seasons)
 
-    logger.info(
-        f"Added {media_data.series_title} with tmdb: {media_data.tmdb_id}, "
-        f"imdb: {media_data.imdb_id}, tvdb: {media_data.tvdb_id}")
+async def add_media_batch(media_list: List[MediaData]):
+    logger.info(f"Add Event Batch: {[media_data.series_title for media_data in media_list]}")
+    seasons_list, titles = await asyncio.gather(
+        asyncio.gather(*(get_seasons(media_data) for media_data in media_list), return_exceptions=True),
+        prefetch_titles(media_list)
+    )
+
+    items = []
+    for media_data, seasons in zip(media_list, seasons_list):
+        if isinstance(seasons, Exception):
+            logger.error(f"Failed to get seasons for {media_data.series_title}: {seasons}")
+            continue
+        media_data.local_title = titles.get((media_data.tmdb_id, get_media_type(media_data), TMDB_LANGUAGE))
+        items.append((media_data, seasons))
+
+    if not items:
+        return
+
+    await add_to_db(items)
+    for media_data, _ in items:
+        scheduler.schedule_grab(media_data)
+        logger.info(
+            f"Added {media_data.series_title} with tmdb: {media_data.tmdb_id}, "
+            f"imdb: {media_data.imdb_id}, tvdb: {media_data.tvdb_id}")
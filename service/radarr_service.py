@@ -1,10 +1,8 @@
-import asyncio
-
 import download
 from download import download_videos
 from logger import get_logger
 from models import MediaData
-from search_links import search_film
+from search_links import NotFound, search_film
 from sonarr import tell_radarr_manual_import
 
 logger = get_logger(__name__)
@@ -13,9 +11,18 @@ logger = get_logger(__name__)
 async def handle_ranarr_media(media: MediaData):
     logger.info(f"[Radarr service] Find movie: {media.series_title}")
 
-    video_links = search_film(media)
+    video_links = await search_film(media)
+    if not video_links:
+        raise NotFound(f"{media.series_title} was not found")
+
+    report = await download_videos(media.internal_id, media.local_title, video_links)
+
+    if not report.succeeded:
+        logger.info(f"[Radarr service] Nothing downloaded for {media.series_title}, skipping import.")
+        return
 
-    path = await asyncio.to_thread(download_videos, media.local_title, video_links)
+    if download.is_cancelled(media.internal_id):
+        logger.info(f"[Radarr service] {media.series_title} was cancelled, skipping import.")
+        return
 
-    if not download.is_aborted():
-        await tell_radarr_manual_import(media, path)
+    await tell_radarr_manual_import(media, report.folder, report.height)
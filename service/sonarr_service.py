@@ -1,23 +1,40 @@
-import asyncio
-
 import download
+import episode_planner
 from download import download_videos
 from models import MediaData
-from search_links import search_film
-from sonarr import get_monitored_seasons, tell_sonarr_manual_import
+from search_links import NotFound, find_film_data, get_episode_links
+from sonarr import tell_sonarr_manual_import
 from logger import get_logger
 
 logger = get_logger(__name__)
 
 
 async def handle_sonarr_media(media: MediaData):
-    seasons = list(get_monitored_seasons(media.internal_id))
+    plan = await episode_planner.plan_series(media.internal_id)
+    seasons = list(plan)
     logger.info(f"[Sonar service] Find seasons: {seasons} for serial: {media.series_title}")
 
-    for season in seasons:
-        video_links = search_film(media, season)
+    if not seasons:
+        return
+
+    # The series JSON-LD lists every season, so one search serves all of them.
+    film_data = await find_film_data(media, seasons[0])
+    if not film_data:
+        raise NotFound(f"{media.series_title} was not found")
+
+    for season, episodes in plan.items():
+        video_links = await get_episode_links(film_data, season, episodes)
+
+        report = await download_videos(media.internal_id, media.series_title, video_links, season, episodes)
+        if download.is_cancelled(media.internal_id):
+            logger.info(f"[Sonar service] {media.series_title} was cancelled, skipping import.")
+            return
+
+        if report.failed:
+            logger.info(f"[Sonar service] Season {season} of {media.series_title}: "
+                        f"failed episodes {[result.episode for result in report.failed]}")
 
-        path = await asyncio.to_thread(download_videos, media.series_title, video_links, season)
+        if not report.succeeded:
+            continue
 
-        if download.is_aborted():
-            await tell_sonarr_manual_import(media, path, season)
+        await tell_sonarr_manual_import(media, report.folder, season, report.height)
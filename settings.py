@@ -11,8 +11,91 @@ RADARR_API_KEY = os.environ.get("RADARR_API_KEY", "")
 
 
 DB_PATH = os.environ.get("DB_PATH", "db/data.db")
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "5"))
+# WAL needs shared memory, so every process using the database must run on one host. Set DELETE when workers
+# on other hosts open it over a network filesystem.
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL").upper()
+DB_MAINTENANCE_HOURS = int(os.environ.get("DB_MAINTENANCE_HOURS", "24"))
 DOWNLOAD_DIR = os.environ.get("DOWNLOAD_DIR", "downloads")
-SCHEDULER_INTERVAL = os.environ.get("SCHEDULER_INTERVAL", "5")
+SCHEDULER_INTERVAL = int(os.environ.get("SCHEDULER_INTERVAL", "5"))
+GRAB_WORKERS = int(os.environ.get("GRAB_WORKERS", "2"))
+GRAB_DELAY_MINUTES = float(os.environ.get("GRAB_DELAY_MINUTES", "3"))
+# "false" when separate `python -m worker` processes grab titles and this process only serves the API.
+EMBEDDED_WORKERS = os.environ.get("EMBEDDED_WORKERS", "true").lower() == "true"
+# Identifies this process in grab leases; defaults to host:pid.
+WORKER_ID = os.environ.get("WORKER_ID", "")
+GRAB_LEASE_SECONDS = int(os.environ.get("GRAB_LEASE_SECONDS", "120"))
+WORKER_POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", "10"))
+# Worker processes sharing the download limits below (DOWNLOAD_CONCURRENCY, DOWNLOAD_HOST_CONCURRENCY,
+# DOWNLOAD_BANDWIDTH and the disk headroom over DOWNLOAD_DISK_RESERVE); each one keeps to an even share.
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "1"))
 
 SEARCH_QUERY = "search?query="
 USER_AGENT = os.environ.get("USER_AGENT", "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36")
+
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "3"))
+DOWNLOAD_HOST_CONCURRENCY = int(os.environ.get("DOWNLOAD_HOST_CONCURRENCY", "2"))
+
+SCRAPE_RATE = float(os.environ.get("SCRAPE_RATE", "1"))
+SCRAPE_BURST = int(os.environ.get("SCRAPE_BURST", "3"))
+SCRAPE_CONCURRENCY = int(os.environ.get("SCRAPE_CONCURRENCY", "4"))
+SCRAPE_TIMEOUT = float(os.environ.get("SCRAPE_TIMEOUT", "10"))
+
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "3"))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", "0.5"))
+
+TMDB_LANGUAGE = os.environ.get("TMDB_LANGUAGE", "uk-UA")
+TITLE_CACHE_SIZE = int(os.environ.get("TITLE_CACHE_SIZE", "1024"))
+TITLE_CACHE_TTL = int(os.environ.get("TITLE_CACHE_TTL", str(7 * 24 * 3600)))
+TITLE_CACHE_NEGATIVE_TTL = int(os.environ.get("TITLE_CACHE_NEGATIVE_TTL", str(24 * 3600)))
+
+PAGE_CACHE_TTL = {
+    "search": int(os.environ.get("PAGE_CACHE_SEARCH_TTL", str(6 * 3600))),
+    "film": int(os.environ.get("PAGE_CACHE_FILM_TTL", str(24 * 3600))),
+    "season": int(os.environ.get("PAGE_CACHE_SEASON_TTL", str(6 * 3600))),
+    "embed": int(os.environ.get("PAGE_CACHE_EMBED_TTL", "3600")),
+}
+
+HTML_PARSER = os.environ.get("HTML_PARSER", "auto")
+JSON_DECODER = os.environ.get("JSON_DECODER", "auto")
+
+DOWNLOAD_MAX_ATTEMPTS = int(os.environ.get("DOWNLOAD_MAX_ATTEMPTS", "5"))
+DOWNLOAD_RETRY_BACKOFF = int(os.environ.get("DOWNLOAD_RETRY_BACKOFF", "300"))
+# A title whose scrape or import fails is retried with the same doubling backoff, then marked failed.
+GRAB_MAX_ATTEMPTS = int(os.environ.get("GRAB_MAX_ATTEMPTS", "5"))
+GRAB_RETRY_BACKOFF = int(os.environ.get("GRAB_RETRY_BACKOFF", "900"))
+DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", str(4 * 3600)))
+DOWNLOAD_STALL_TIMEOUT = int(os.environ.get("DOWNLOAD_STALL_TIMEOUT", "180"))
+# Sizes and rates accept yt-dlp's notation (500K, 4.2M, 1G); a bandwidth of 0 means unlimited.
+DOWNLOAD_BANDWIDTH = os.environ.get("DOWNLOAD_BANDWIDTH", "0")
+DOWNLOAD_BANDWIDTH_SCHEDULE = os.environ.get("DOWNLOAD_BANDWIDTH_SCHEDULE", "")
+DOWNLOAD_DISK_RESERVE = os.environ.get("DOWNLOAD_DISK_RESERVE", "5G")
+DOWNLOAD_SIZE_ESTIMATE = os.environ.get("DOWNLOAD_SIZE_ESTIMATE", "1G")
+DOWNLOAD_DISK_CHECK_INTERVAL = int(os.environ.get("DOWNLOAD_DISK_CHECK_INTERVAL", "30"))
+# "auto" fetches HLS natively and falls back to yt-dlp; "yt-dlp" always uses yt-dlp.
+DOWNLOAD_BACKEND = os.environ.get("DOWNLOAD_BACKEND", "auto")
+HLS_QUALITY = os.environ.get("HLS_QUALITY", "best")
+HLS_SEGMENT_CONCURRENCY = int(os.environ.get("HLS_SEGMENT_CONCURRENCY", "6"))
+HLS_MAX_CONNECTIONS = int(os.environ.get("HLS_MAX_CONNECTIONS", "16"))
+# "latency" downloads from the fastest source of at least SOURCE_MIN_HEIGHT, "quality" from the best one.
+SOURCE_POLICY = os.environ.get("SOURCE_POLICY", "latency")
+SOURCE_MIN_HEIGHT = int(os.environ.get("SOURCE_MIN_HEIGHT", "720"))
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", "10"))
+# Probes share the hls connection pool with downloads, so only this many run at once across all titles.
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", "8"))
+PROBE_BYTES = int(os.environ.get("PROBE_BYTES", str(64 * 1024)))
+# Below DOWNLOAD_MIN_SPEED over DOWNLOAD_SLOW_WINDOW seconds a download fails over to the next mirror; 0 disables it.
+DOWNLOAD_MIN_SPEED = os.environ.get("DOWNLOAD_MIN_SPEED", "0")
+DOWNLOAD_SLOW_WINDOW = int(os.environ.get("DOWNLOAD_SLOW_WINDOW", "60"))
+HLS_HEDGE_AFTER = float(os.environ.get("HLS_HEDGE_AFTER", "5"))
+HOST_MAX_ERROR_RATE = float(os.environ.get("HOST_MAX_ERROR_RATE", "0.5"))
+
+INGEST_WINDOW = float(os.environ.get("INGEST_WINDOW", "2"))
+INGEST_MAX_BATCH = int(os.environ.get("INGEST_MAX_BATCH", "200"))
+
+SONARR_SNAPSHOT_TTL = int(os.environ.get("SONARR_SNAPSHOT_TTL", "3600"))
@@ -1,49 +1,49 @@
 import os
-from typing import List
-
-import httpx
+from typing import Optional
 
+import http_clients
+import metrics
 from models import MediaData
-from settings import SONARR_API_KEY, SONARR_URL, RADARR_URL, RADARR_API_KEY, DOWNLOAD_DIR
+from settings import DOWNLOAD_DIR
 from logger import get_logger
 
 logger = get_logger(__name__)
 
-
-async def get_monitored_seasons(series_id: int):
-    url = f"{SONARR_URL}/api/v3/series/{series_id}"
-    headers = {
-        "X-Api-Key": SONARR_API_KEY
+# Sonarr and Radarr share these quality ids for web downloads.
+WEB_QUALITIES = [(2160, 18, "WEBDL-2160p"), (1080, 3, "WEBDL-1080p"), (720, 5, "WEBDL-720p"), (480, 8, "WEBDL-480p")]
+
+
+def get_quality(height: Optional[int]) -> dict:
+    # A source that didn't report its resolution is assumed to be 720p, as every import used to be.
+    height = height or 720
+    resolution, quality_id, name = next(
+        (quality for quality in WEB_QUALITIES if height >= quality[0] * 0.9), WEB_QUALITIES[-1])
+    return {
+        "quality": {
+            "id": quality_id,
+            "name": name,
+            "source": "web",
+            "resolution": resolution,
+            "modifier": "none"
+        },
+        "revision": {
+            "version": 1,
+            "real": 0,
+            "isRepack": False
+        }
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
-        response.raise_for_status()
-
-    series_data = response.json()
-
-    monitored_seasons = [
-        season["seasonNumber"]
-        for season in series_data.get("seasons", [])
-        if season.get("monitored", False)
-    ]
-
-    return monitored_seasons
-
 
-async def tell_sonarr_manual_import(media: MediaData, download_folder, season: int = 0):
-    url = f"{SONARR_URL}/api/v3/manualimport"
+async def tell_sonarr_manual_import(media: MediaData, download_folder, season: int = 0,
+                                    height: Optional[int] = None):
     path = os.path.abspath(os.path.join(DOWNLOAD_DIR, download_folder))
-    headers = {
-        "X-Api-Key": SONARR_API_KEY,
-        "Content-Type": "application/json"
-    }
 
     payload = [
         {
             "path": path,
             "seriesId": media.internal_id,
             "seasonNumber": season,
+            "quality": get_quality(height),
             "languages": [
                 {
                     "id": 1,
@@ -53,21 +53,15 @@ async def tell_sonarr_manual_import(media: MediaData, download_folder, season: i
         }
     ]
     logger.info(f"[Sonarr Manual Import] payload: {payload}")
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=payload)
-        logger.info(f"[Sonarr Manual Import]  response for internal_id: {media.internal_id}, "
-                     f"Response: {response.json()}")
-        response.raise_for_status()
-
+    with metrics.import_seconds.time("sonarr"):
+        response = await http_clients.request("sonarr", "POST", "/api/v3/manualimport", json=payload)
+    metrics.imports.inc("sonarr", str(response.status_code))
+    logger.info(f"[Sonarr Manual Import]  response for internal_id: {media.internal_id}, "
+                f"Response: {response.json()}")
+    response.raise_for_status()
 
-async def tell_radarr_manual_import(media: MediaData, download_folder: str):
-    url = f"{RADARR_URL}/api/v3/manualimport"
-
-    headers = {
-        "X-Api-Key": RADARR_API_KEY,
-        "Content-Type": "application/json"
-    }
 
+async def tell_radarr_manual_import(media: MediaData, download_folder: str, height: Optional[int] = None):
     payload = [
         {
             "path": download_folder,
@@ -81,20 +75,7 @@ async def tell_radarr_manual_import(media: MediaData, download_folder: str):
                 "minimumAvailability": "released",
                 "qualityProfileId": 1
             },
-            "quality": {
-                "quality": {
-                    "id": 1,
-                    "name": "HD-720p",
-                    "source": "web",
-                    "resolution": 720,
-                    "modifier": "none"
-                },
-                "revision": {
-                    "version": 1,
-                    "real": 0,
-                    "isRepack": True
-                }
-            },
+            "quality": get_quality(height),
             "languages": [
                 {
                     "id": 1,
@@ -104,8 +85,9 @@ async def tell_radarr_manual_import(media: MediaData, download_folder: str):
         }
     ]
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=payload)
-        logger.info(f"[Radarr Manual Import] response for internal_id: {media.internal_id}, "
-                     f"Resp: {response.json()}")
-        response.raise_for_status()
+    with metrics.import_seconds.time("radarr"):
+        response = await http_clients.request("radarr", "POST", "/api/v3/manualimport", json=payload)
+    metrics.imports.inc("radarr", str(response.status_code))
+    logger.info(f"[Radarr Manual Import] response for internal_id: {media.internal_id}, "
+                f"Resp: {response.json()}")
+    response.raise_for_status()
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import http_clients
+from settings import SONARR_SNAPSHOT_TTL
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# series id -> series JSON from /api/v3/series, refreshed in full every SONARR_SNAPSHOT_TTL seconds
+# and per series whenever a webhook tells us one changed.
+series: Dict[int, dict] = {}
+loaded_on = 0.0
+load_lock = asyncio.Lock()
+
+
+async def load():
+    global loaded_on
+
+    async with load_lock:
+        if time.time() - loaded_on < SONARR_SNAPSHOT_TTL:
+            return
+        response = await http_clients.request("sonarr", "GET", "/api/v3/series")
+        response.raise_for_status()
+
+        series.clear()
+        series.update((item["id"], item) for item in response.json())
+        loaded_on = time.time()
+        logger.info(f"[Sonarr Snapshot] Loaded {len(series)} series")
+
+
+async def refresh_series(series_id: int) -> Optional[dict]:
+    response = await http_clients.request("sonarr", "GET", f"/api/v3/series/{series_id}")
+    if response.status_code == 404:
+        invalidate(series_id)
+        return None
+    response.raise_for_status()
+
+    series[series_id] = response.json()
+    return series[series_id]
+
+
+def invalidate(series_id: int):
+    # The next lookup fetches just this series instead of reloading the whole library.
+    series.pop(series_id, None)
+
+
+async def get_series(series_id: int) -> Optional[dict]:
+    await load()
+    if series_id in series:
+        return series[series_id]
+    return await refresh_series(series_id)
+
+
+async def get_monitored_seasons(series_id: int) -> List[int]:
+    data = await get_series(series_id)
+    if not data:
+        return []
+    return [
+        season["seasonNumber"]
+        for season in data.get("seasons", [])
+        if season.get("monitored", False)
+    ]
+
+
+def is_season_complete(season: dict) -> bool:
+    statistics = season.get("statistics") or {}
+    episode_count = statistics.get("episodeCount", 0)
+    return episode_count > 0 and statistics.get("episodeFileCount", 0) >= episode_count
+
+
+async def get_missing_seasons(series_id: int) -> List[int]:
+    """
+    Monitored seasons that still lack at least one aired episode file.
+    """
+    data = await get_series(series_id)
+    if not data:
+        return []
+    return [
+        season["seasonNumber"]
+        for season in data.get("seasons", [])
+        if season.get("monitored", False) and not is_season_complete(season)
+    ]
+
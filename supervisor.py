@@ -0,0 +1,266 @@
+import asyncio
+import os
+import re
+import signal
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import admission
+import metrics
+from models import DownloadProgress
+from settings import DOWNLOAD_TIMEOUT, DOWNLOAD_STALL_TIMEOUT, DOWNLOAD_SLOW_WINDOW
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+PROGRESS_PREFIX = "[progress]"
+# --progress keeps the progress lines even with --quiet; missing values are printed as NA.
+PROGRESS_ARGS = [
+    "--progress",
+    "--newline",
+    "--progress-template",
+    f"download:{PROGRESS_PREFIX} %(progress.downloaded_bytes)s %(progress.total_bytes)s "
+    f"%(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s",
+]
+# yt-dlp can't change its rate limit while running, so a job is restarted (and resumed with --continue)
+# only when its share moved by more than this and it has run long enough to be worth interrupting.
+REBALANCE_TOLERANCE = 0.25
+REBALANCE_MIN_RUNTIME = 60
+# yt-dlp messages that put a failure on the host rather than on us (a missing ffmpeg, a full disk, ...).
+HOST_ERROR = re.compile(r"HTTP Error \d+|urlopen error|Connection (?:refused|reset)|timed out")
+
+# Live progress of the running downloads, by download job id.
+jobs: Dict[int, DownloadProgress] = {}
+# Only yt-dlp jobs need a restart to change their rate; native HLS jobs read get_rate_limit() as they go.
+restarts: Dict[int, asyncio.Event] = {}
+launched_on: Dict[int, float] = {}
+totals = {"bytes": 0, "finished": 0, "failed": 0, "started_on": time.time()}
+
+metrics.downloads_running.set_function(lambda: {(): len(jobs)})
+metrics.download_speed.set_function(lambda: {(): sum(progress.speed or 0 for progress in jobs.values())})
+
+
+class TooSlow(Exception):
+    """
+    The download stayed under its minimum speed; another mirror should take over.
+    """
+
+
+class SpeedWatch:
+    """
+    Tells when a job's speed over the last DOWNLOAD_SLOW_WINDOW seconds is under min_speed.
+    """
+
+    def __init__(self, progress: DownloadProgress, min_speed: Optional[int]):
+        self.progress = progress
+        self.min_speed = min_speed
+        self.samples = deque()
+
+    def is_slow(self) -> bool:
+        if not self.min_speed:
+            return False
+        now = time.monotonic()
+        self.samples.append((now, self.progress.downloaded_bytes))
+        # Keep the newest sample that is at least a window old as the baseline.
+        while len(self.samples) > 1 and now - self.samples[1][0] >= DOWNLOAD_SLOW_WINDOW:
+            self.samples.popleft()
+        since, downloaded = self.samples[0]
+        if now - since < DOWNLOAD_SLOW_WINDOW:
+            return False
+        # A job held under the threshold by the bandwidth budget is not the mirror's fault.
+        if self.progress.rate_limit and self.progress.rate_limit < self.min_speed:
+            return False
+        return (self.progress.downloaded_bytes - downloaded) / (now - since) < self.min_speed
+
+
+def parse_number(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def update_progress(progress: DownloadProgress, line: str) -> int:
+    """
+    Applies one progress line and returns how many new bytes arrived since the last one.
+    """
+    values = [parse_number(value) for value in line[len(PROGRESS_PREFIX):].split()]
+    if len(values) != 5:
+        return 0
+    downloaded, total, estimate, speed, eta = values
+
+    received = 0
+    if downloaded is not None:
+        received = max(int(downloaded) - progress.downloaded_bytes, 0)
+        progress.downloaded_bytes = int(downloaded)
+    total = total or estimate
+    progress.total_bytes = int(total) if total else progress.total_bytes
+    progress.speed = speed
+    progress.eta = int(eta) if eta is not None else None
+    progress.updated_on = time.time()
+    progress.average_speed = progress.downloaded_bytes / max(progress.updated_on - progress.started_on, 1)
+    return received
+
+
+def get_rate_limit() -> Optional[int]:
+    budget = admission.current_budget()
+    if not budget:
+        return None
+    return max(budget // max(len(jobs), 1), 1)
+
+
+def rebalance():
+    rate = get_rate_limit()
+    now = time.monotonic()
+    for job_id, restart in restarts.items():
+        current = jobs[job_id].rate_limit
+        if current == rate:
+            continue
+        if current and rate and abs(rate - current) <= current * REBALANCE_TOLERANCE:
+            continue
+        if now - launched_on.get(job_id, now) < REBALANCE_MIN_RUNTIME:
+            continue
+        restart.set()
+
+
+async def apply_bandwidth_schedule():
+    rebalance()
+
+
+def kill(process: asyncio.subprocess.Process):
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def watch_output(process: asyncio.subprocess.Process, progress: DownloadProgress,
+                       restart: asyncio.Event, speed: SpeedWatch) -> Optional[str]:
+    """
+    Reads yt-dlp output until it exits; returns "timeout", "stalled", "slow" or "restart" if it has to be killed.
+    """
+    last_growth = time.monotonic()
+    deadline = last_growth + DOWNLOAD_TIMEOUT - (time.time() - progress.started_on)
+    # The first line of a launch reports what an earlier run already left on disk.
+    baseline = True
+    while True:
+        now = time.monotonic()
+        if restart.is_set():
+            return "restart"
+        if now >= deadline:
+            return "timeout"
+        if now - last_growth >= DOWNLOAD_STALL_TIMEOUT:
+            return "stalled"
+        if speed.is_slow():
+            return "slow"
+        wait = min(deadline, last_growth + DOWNLOAD_STALL_TIMEOUT, now + 1) - now
+        try:
+            line = await asyncio.wait_for(process.stdout.readline(), wait)
+        except asyncio.TimeoutError:
+            continue
+        if not line:
+            return None
+
+        line = line.decode(errors="replace").strip()
+        if line.startswith(PROGRESS_PREFIX):
+            received = update_progress(progress, line)
+            if received:
+                last_growth = time.monotonic()
+                if baseline:
+                    progress.resumed_bytes += received
+                else:
+                    totals["bytes"] += received
+            baseline = False
+        elif line:
+            logger.info(f"[yt-dlp] {line}")
+            if HOST_ERROR.search(line):
+                progress.host_error = line
+
+
+def track(job_id: int, filename: str) -> DownloadProgress:
+    now = time.time()
+    progress = DownloadProgress(job_id=job_id, filename=filename, started_on=now, updated_on=now)
+    jobs[job_id] = progress
+    rebalance()
+    return progress
+
+
+def untrack(progress: DownloadProgress):
+    jobs.pop(progress.job_id, None)
+    restarts.pop(progress.job_id, None)
+    launched_on.pop(progress.job_id, None)
+    rebalance()
+    if progress.state in ("finished", "failed"):
+        totals[progress.state] += 1
+    progress.updated_on = time.time()
+
+
+async def run(job_id: int, filename: str, build_command: Callable[[Optional[int]], List[str]],
+              min_speed: Optional[int] = None) -> DownloadProgress:
+    progress = track(job_id, filename)
+    restarts[job_id] = asyncio.Event()
+    speed = SpeedWatch(progress, min_speed)
+    reason = None
+
+    try:
+        while True:
+            progress.rate_limit = get_rate_limit()
+            restarts[job_id].clear()
+            launched_on[job_id] = time.monotonic()
+            progress.host_error = None
+            process = await asyncio.create_subprocess_exec(
+                *build_command(progress.rate_limit),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True
+            )
+            try:
+                reason = await watch_output(process, progress, restarts[job_id], speed)
+                if reason:
+                    kill(process)
+                await process.wait()
+            finally:
+                # Cancelling the awaiting task kills yt-dlp too, so no process outlives its job.
+                kill(process)
+
+            metrics.ytdlp_exits.inc(reason or str(process.returncode))
+            if reason != "restart":
+                break
+            logger.info(f"[Bandwidth] Restarting {filename} with a new rate limit")
+        if reason:
+            logger.error(f"❌ yt-dlp {reason} for {filename}")
+            progress.state, progress.error = "failed", reason
+            if reason == "slow":
+                progress.host_error = reason
+        elif process.returncode != 0:
+            progress.state, progress.error = "failed", f"yt-dlp exited with {process.returncode}"
+        else:
+            progress.state = "finished"
+    except OSError as e:
+        progress.state, progress.error = "failed", str(e)
+    finally:
+        untrack(progress)
+    return progress
+
+
+def get_progress() -> List[DownloadProgress]:
+    return list(jobs.values())
+
+
+def get_throughput() -> dict:
+    uptime = max(time.time() - totals["started_on"], 1)
+    return {
+        "budget": admission.current_budget() or None,
+        "rate_limit_per_job": get_rate_limit(),
+        "speed": sum(progress.speed or 0 for progress in jobs.values()),
+        "downloaded_bytes": totals["bytes"],
+        "average_speed": totals["bytes"] / uptime,
+        "finished": totals["finished"],
+        "failed": totals["failed"],
+        "jobs": [progress.model_dump(include={"job_id", "filename", "speed", "average_speed", "rate_limit"})
+                 for progress in jobs.values()],
+        "disk": admission.get_disk_status(get_progress()),
+    }
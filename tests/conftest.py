@@ -0,0 +1,58 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+from fastapi import FastAPI, Response  # noqa: E402
+
+import http_clients  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "hls")
+# The fake CDN answers for any host, so mirrors are the same path under another name.
+BASE_URL = "http://cdn.test"
+
+
+def segment_body(index: int) -> bytes:
+    return f"segment {index};".encode() * 1000
+
+
+def create_cdn(requests: list, delays: dict, missing: set) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/{name}.m3u8")
+    async def playlist(name: str):
+        with open(os.path.join(FIXTURES, f"{name}.m3u8"), "rb") as f:
+            return Response(f.read(), media_type="application/vnd.apple.mpegurl")
+
+    @app.get("/{height}/index.m3u8")
+    async def variant(height: str):
+        requests.append(f"{height}/index.m3u8")
+        return await playlist("media")
+
+    @app.get("/{height}/segment-{index}.ts")
+    @app.get("/segment-{index}.ts")
+    async def segment(index: int, height: str = ""):
+        requests.append(index)
+        if index in missing:
+            return Response(status_code=404)
+        await asyncio.sleep(delays.get(index, 0))
+        return Response(segment_body(index), media_type="video/mp2t")
+
+    return app
+
+
+@pytest.fixture
+def cdn():
+    """
+    Serves the playlists in fixtures/hls to the "hls" client; yields the requested segments, the delay and the
+    missing segments by index.
+    """
+    requests, delays, missing = [], {}, set()
+    app = create_cdn(requests, delays, missing)
+    http_clients.clients["hls"] = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+    http_clients.stats["hls"] = http_clients.new_stats()
+    yield requests, delays, missing
+    http_clients.clients.pop("hls", None)
@@ -0,0 +1,62 @@
+import asyncio
+
+import httpx
+import pytest
+
+import episode_planner
+import http_clients
+import sonarr_snapshot
+from bench.upstreams import create_sonarr
+
+SERIES_ID = 1
+
+
+def plan(overrides=None, episode_files=None, seasons=2, episodes=3):
+    async def run():
+        app = create_sonarr(1, seasons, episodes, overrides, episode_files)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://sonarr")
+        http_clients.clients["sonarr"] = client
+        http_clients.stats["sonarr"] = http_clients.new_stats()
+        try:
+            return await episode_planner.plan_series(SERIES_ID)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def reset_snapshot():
+    sonarr_snapshot.series.clear()
+    sonarr_snapshot.loaded_on = 0.0
+    yield
+    sonarr_snapshot.series.clear()
+    sonarr_snapshot.loaded_on = 0.0
+    http_clients.clients.pop("sonarr", None)
+
+
+def test_plans_every_missing_episode():
+    assert plan() == {1: [1, 2, 3], 2: [1, 2, 3]}
+
+
+def test_skips_episode_with_file():
+    assert plan({(1, 2): {"hasFile": True, "episodeFileId": 7}}, [{"id": 7}]) == {1: [1, 3], 2: [1, 2, 3]}
+
+
+def test_keeps_episode_with_dangling_file_id():
+    # Sonarr still says hasFile, but the file it points at is gone.
+    assert plan({(1, 2): {"hasFile": True, "episodeFileId": 99}}, [{"id": 7}]) == {1: [1, 2, 3], 2: [1, 2, 3]}
+
+
+def test_skips_unmonitored_episode():
+    assert plan({(2, 3): {"monitored": False}}) == {1: [1, 2, 3], 2: [1, 2]}
+
+
+def test_skips_unaired_episode():
+    overrides = {(2, 1): {"airDateUtc": "2999-01-01T00:00:00Z"}, (2, 2): {"airDateUtc": None}}
+    assert plan(overrides) == {1: [1, 2, 3], 2: [3]}
+
+
+def test_drops_season_with_nothing_to_grab():
+    overrides = {(2, number): {"monitored": False} for number in (1, 2, 3)}
+    assert plan(overrides) == {1: [1, 2, 3]}
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import events
+import main
+
+client = TestClient(main.app)
+
+
+@pytest.mark.parametrize("decoder", sorted(events.DECODERS))
+@pytest.mark.parametrize("event_type", ["Health", "HealthRestored", "ApplicationUpdate"])
+def test_event_without_title_is_ignored(decoder, event_type):
+    body = json.dumps({"eventType": event_type, "level": "warning", "message": "Indexers unavailable"}).encode()
+    assert events.to_media_data(events.DECODERS[decoder](body), "SONARR") is None
+
+
+@pytest.mark.parametrize("path", ["/webhook/sonarr", "/webhook/radarr"])
+def test_ignored_event_is_accepted(path):
+    response = client.post(path, json={"eventType": "Health", "level": "warning", "message": "Disk full"})
+    assert response.status_code == 202
+
+
+@pytest.mark.parametrize("path, event_type", [("/webhook/sonarr", "SeriesAdd"), ("/webhook/radarr", "MovieDelete")])
+def test_add_or_delete_without_title_is_rejected(path, event_type):
+    assert client.post(path, json={"eventType": event_type}).status_code == 400
+
+
+def test_add_event_is_mapped():
+    body = json.dumps({"eventType": "SeriesAdd", "series": {"id": 42, "title": "Show", "tmdbId": 1405,
+                                                            "tvdbId": 95491, "imdbId": "tt1"}}).encode()
+    media = events.to_media_data(events.decode(body), "SONARR")
+    assert (media.internal_id, media.series_title, media.tmdb_id, media.event_type) == (42, "Show", 1405, "SeriesAdd")
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+
+import httpx
+import pytest
+
+import download
+import hls
+import metrics
+import supervisor
+from conftest import BASE_URL, FIXTURES, segment_body
+
+
+def fetch(segments, workdir, state):
+    progress = supervisor.track(1, "test.mp4")
+    try:
+        return asyncio.run(hls.fetch_all(segments, workdir, progress, state, supervisor.SpeedWatch(progress, None)))
+    finally:
+        supervisor.untrack(progress)
+
+
+def resolve(url):
+    return asyncio.run(hls.resolve_playlist(url))
+
+
+def test_master_picks_best_variant(cdn):
+    variant, segments = resolve(f"{BASE_URL}/master.m3u8")
+    assert (variant.width, variant.height, variant.bandwidth) == (1920, 1080, 5000000)
+    assert [segment.url for segment in segments[:2]] == [f"{BASE_URL}/1080/segment-0.ts",
+                                                        f"{BASE_URL}/1080/segment-1.ts"]
+    assert sum(segment.duration for segment in segments) == 28.5
+
+
+def test_choose_variant_policies():
+    with open(os.path.join(FIXTURES, "master.m3u8")) as f:
+        variants = hls.parse_master(f.read(), f"{BASE_URL}/master.m3u8")
+    assert hls.choose_variant(variants, "best").height == 1080
+    assert hls.choose_variant(variants, "worst").height == 360
+    assert hls.choose_variant(variants, "720").height == 720
+    assert hls.choose_variant(variants, "240").height == 360
+
+
+def test_appends_in_playlist_order(cdn, tmp_path):
+    requests, delays, _ = cdn
+    # Early segments finish last, so the append has to wait for them.
+    delays.update({0: 0.2, 1: 0.1})
+    _, segments = resolve(f"{BASE_URL}/media.m3u8")
+    state = hls.load_state(str(tmp_path), hls.get_playlist_key(segments), len(segments))
+
+    combined = fetch(segments, str(tmp_path), state)
+
+    with open(combined, "rb") as f:
+        assert f.read() == b"".join(segment_body(index) for index in range(5))
+    assert sorted(requests) == [0, 1, 2, 3, 4]
+    with open(tmp_path / "state.json") as f:
+        assert json.load(f)["appended"] == 5
+    assert sorted(os.listdir(tmp_path)) == ["combined.ts", "state.json"]
+
+
+def test_resumes_from_state(cdn, tmp_path):
+    requests, _, _ = cdn
+    _, segments = resolve(f"{BASE_URL}/media.m3u8")
+    key = hls.get_playlist_key(segments)
+    done = segment_body(0) + segment_body(1)
+    # A torn write of segment 2 from the interrupted run follows the recorded size.
+    (tmp_path / "combined.ts").write_bytes(done + b"torn")
+    hls.save_state(str(tmp_path), {"playlist": key, "segments": len(segments), "appended": 2, "size": len(done)})
+
+    state = hls.load_state(str(tmp_path), key, len(segments))
+    combined = fetch(segments, str(tmp_path), state)
+
+    with open(combined, "rb") as f:
+        assert f.read() == b"".join(segment_body(index) for index in range(5))
+    assert sorted(requests) == [2, 3, 4]
+
+
+def test_failed_segment_stops_the_others(cdn, tmp_path):
+    _, delays, missing = cdn
+    missing.add(1)
+    delays.update({2: 0.5, 3: 0.5, 4: 0.5})
+    _, segments = resolve(f"{BASE_URL}/media.m3u8")
+    state = hls.load_state(str(tmp_path), hls.get_playlist_key(segments), len(segments))
+
+    async def run():
+        progress = supervisor.track(1, "test.mp4")
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await hls.fetch_all(segments, str(tmp_path), progress, state, supervisor.SpeedWatch(progress, None))
+            # The fetches still in flight are gone by the time fetch_all raises, not at some later point.
+            return sorted(os.listdir(tmp_path)), [task for task in asyncio.all_tasks()
+                                                  if task is not asyncio.current_task()]
+        finally:
+            supervisor.untrack(progress)
+
+    files, pending = asyncio.run(run())
+    assert files == ["combined.ts", "state.json"]
+    assert pending == []
+    assert state["appended"] == 1
+
+
+def test_resumed_bytes_are_not_counted_again(cdn, tmp_path, monkeypatch):
+    output_path = str(tmp_path / "test.mp4")
+    _, segments = resolve(f"{BASE_URL}/media.m3u8")
+    done = segment_body(0) + segment_body(1)
+    os.makedirs(output_path + ".hls")
+    with open(output_path + ".hls/combined.ts", "wb") as f:
+        f.write(done)
+    hls.save_state(output_path + ".hls", {"playlist": hls.get_playlist_key(segments), "segments": len(segments),
+                                          "appended": 2, "size": len(done)})
+
+    async def remux(source, output):
+        pass
+
+    monkeypatch.setattr(hls, "remux", remux)
+    before = metrics.download_bytes.values.get(("hls",), 0)
+    progress = asyncio.run(hls.download(1, f"{BASE_URL}/media.m3u8", "test.mp4", output_path))
+    download.observe_download("hls", 0, progress)
+    assert progress.state == "finished"
+    assert metrics.download_bytes.values[("hls",)] - before == sum(len(segment_body(index)) for index in (2, 3, 4))
+
+
+def test_state_of_another_playlist_starts_over(tmp_path):
+    hls.save_state(str(tmp_path), {"playlist": "other", "segments": 5, "appended": 3, "size": 100})
+    assert hls.load_state(str(tmp_path), "this", 5) == {"playlist": "this", "segments": 5, "appended": 0, "size": 0}
+
+
+def test_timeout_fails_without_fallback(cdn, tmp_path, monkeypatch):
+    _, delays, _ = cdn
+    delays.update({index: 1 for index in range(5)})
+    monkeypatch.setattr(hls, "DOWNLOAD_TIMEOUT", 0.2)
+    progress = asyncio.run(hls.download(1, f"{BASE_URL}/media.m3u8", "test.mp4", str(tmp_path / "test.mp4")))
+    assert (progress.state, progress.error) == ("failed", "timeout")
+
+
+@pytest.mark.parametrize("name, error", [("encrypted", "encrypted playlist"), ("live", "live playlist")])
+def test_unsupported_falls_back(cdn, tmp_path, name, error):
+    requests, _, _ = cdn
+    progress = asyncio.run(hls.download(1, f"{BASE_URL}/{name}.m3u8", "test.mp4", str(tmp_path / "test.mp4")))
+    assert (progress.state, progress.error) == ("fallback", error)
+    assert requests == []
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+import host_health
+import probe
+import search_links
+
+
+@pytest.fixture(autouse=True)
+def host(cdn, monkeypatch):
+    monkeypatch.setattr(probe, "PROBE_TIMEOUT", 0.2)
+    host_health.hosts.clear()
+    yield cdn
+    host_health.hosts.clear()
+
+
+def test_success_records_latency():
+    source = asyncio.run(probe.probe_source("http://good.test/media.m3u8"))
+    assert source.latency is not None
+    assert host_health.hosts["good.test"]["error_rate"] == 0.0
+
+
+def test_status_error_counts_against_host(host):
+    _, _, missing = host
+    missing.add(0)
+    assert asyncio.run(probe.probe_source("http://bad.test/media.m3u8")) is None
+    assert host_health.hosts["bad.test"]["error_rate"] == 1.0
+
+
+def test_own_timeout_does_not_count_against_host(host):
+    _, delays, _ = host
+    delays[0] = 1
+    assert asyncio.run(probe.probe_source("http://slow.test/media.m3u8")) is None
+    assert "slow.test" not in host_health.hosts
+
+
+def test_best_source_ranks_only_mirrors_of_the_chosen_track():
+    # Another voiceover on a different path is neither probed nor kept as a mirror.
+    options = ["http://ashdi.test/media.m3u8", "http://other.test/master.m3u8", "http://mirror.test/media.m3u8"]
+    source = asyncio.run(search_links.get_best_source(options))
+    assert {source.url, *(alternative.url for alternative in source.alternatives)} == {
+        "http://ashdi.test/media.m3u8", "http://mirror.test/media.m3u8"}
+    assert "other.test" not in host_health.hosts
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+
+import database
+import scheduler
+import search_links
+from models import MediaData
+from settings import GRAB_MAX_ATTEMPTS, GRAB_RETRY_BACKOFF
+
+MOVIE = MediaData(internal_id=7, created_on="2020-01-01 00:00:00", source_type="RADARR", event_type="MovieAdded",
+                  series_title="Movie", tmdb_id=70, imdb_id=None, tvdb_id=None, local_title="Movie")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture(autouse=True)
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "data.db"))
+    run(database.init_db())
+    run(database.add_to_db([(MOVIE, [])]))
+    yield
+    run(database.close_db())
+
+
+def get_title() -> tuple:
+    return run(database.repository(lambda conn: conn.execute(
+        "SELECT status, attempts, next_attempt_on FROM media_data WHERE internal_id = ?", (MOVIE.internal_id,)
+    ).fetchone())())
+
+
+def is_due() -> bool:
+    return [media.internal_id for media in run(database.get_media_added_more_than(0))] == [MOVIE.internal_id]
+
+
+def fail_grab(monkeypatch):
+    async def not_found(media):
+        raise search_links.NotFound(f"{media.series_title} was not found")
+
+    monkeypatch.setattr(scheduler, "handle_ranarr_media", not_found)
+    run(scheduler.grab_media(MOVIE))
+
+
+def test_failed_grab_backs_off(monkeypatch):
+    assert is_due()
+    fail_grab(monkeypatch)
+
+    status, attempts, next_attempt_on = get_title()
+    assert (status, attempts) == ("retrying", 1)
+    assert next_attempt_on == pytest.approx(time.time() + GRAB_RETRY_BACKOFF, abs=5)
+    assert not is_due()
+    assert run(database.claim_next_title("worker", 60, 0)) is None
+    assert run(scheduler.get_retry_after(MOVIE.internal_id)) == pytest.approx(GRAB_RETRY_BACKOFF, abs=5)
+
+    fail_grab(monkeypatch)
+    _, attempts, next_attempt_on = get_title()
+    assert attempts == 2
+    assert next_attempt_on == pytest.approx(time.time() + GRAB_RETRY_BACKOFF * 2, abs=5)
+
+
+def test_title_fails_for_good_after_the_cap(monkeypatch):
+    for _ in range(GRAB_MAX_ATTEMPTS):
+        fail_grab(monkeypatch)
+    assert get_title()[:2] == ("failed", GRAB_MAX_ATTEMPTS)
+
+    run(database.repository(lambda conn: conn.execute("UPDATE media_data SET next_attempt_on = 0") and conn.commit())())
+    assert not is_due()
+    assert run(database.claim_next_title("worker", 60, 0)) is None
+
+
+def test_clean_grab_resets_attempts(monkeypatch):
+    fail_grab(monkeypatch)
+    assert run(database.finish_title_attempt(MOVIE.internal_id, False)) == "retrying"
+    assert get_title() == ("retrying", 0, 0)
+    assert is_due()
@@ -0,0 +1,88 @@
+import asyncio
+import signal
+
+import database
+import download
+import host_health
+import scheduler
+import sonarr_snapshot
+from http_clients import start_clients, close_clients
+from localization import prefetch_titles, get_media_type
+from settings import GRAB_WORKERS, GRAB_DELAY_MINUTES, GRAB_LEASE_SECONDS, TMDB_LANGUAGE, WORKER_POLL_INTERVAL
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Run any number of these next to one API process with EMBEDDED_WORKERS=false, sharing the database and the
+# download folder (other hosts only with DB_JOURNAL_MODE=DELETE, see the README). A title is leased to one worker
+# at a time.
+stopping = asyncio.Event()
+
+
+async def grab_next() -> bool:
+    media = await database.claim_next_title(scheduler.worker_id, GRAB_LEASE_SECONDS, GRAB_DELAY_MINUTES)
+    if media is None:
+        return False
+    try:
+        if stopping.is_set():
+            return True
+        # The webhooks that invalidate a changed series reach the API process, not this one.
+        if media.source_type == "SONARR":
+            sonarr_snapshot.invalidate(media.internal_id)
+        if not media.local_title:
+            titles = await prefetch_titles([media])
+            media.local_title = titles.get((media.tmdb_id, get_media_type(media), TMDB_LANGUAGE))
+        await scheduler.grab_media(media)
+    finally:
+        # A title stopped by shutdown goes straight back to the others; one left retrying waits for its next episode.
+        retry_after = 0 if stopping.is_set() else await scheduler.get_retry_after(media.internal_id)
+        await database.release_title(scheduler.worker_id, media.internal_id, retry_after)
+    return True
+
+
+async def grab_loop(number: int):
+    while not stopping.is_set():
+        try:
+            found = await grab_next()
+        except Exception as e:
+            logger.error(f"[Worker {number}] Grab failed: {e}")
+            found = False
+        if found:
+            continue
+        try:
+            await asyncio.wait_for(stopping.wait(), WORKER_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def stop():
+    if stopping.is_set():
+        return
+    logger.info("[Worker] Stopping, running downloads are handed back to the queue")
+    stopping.set()
+    download.stop_all_downloads()
+
+
+async def run():
+    await database.init_db()
+    await database.requeue_running_jobs()
+    await host_health.load()
+    await start_clients()
+    await scheduler.start_worker_scheduler()
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop)
+
+    logger.info(f"[Worker] {scheduler.worker_id} started with {GRAB_WORKERS} grab workers")
+    try:
+        await asyncio.gather(*(grab_loop(number) for number in range(GRAB_WORKERS)))
+    finally:
+        await scheduler.shutdown()
+        await host_health.save()
+        await close_clients()
+        await database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())